@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List
+
+import NHP
+from Telemetry import percentile, server_timing, tracer
+
+
+# === USER CONFIGURABLE PARAMETERS ===
+# One question per line: plain text in a .txt file, or JSON in a .jsonl file:
+#   {"id": "lock-on", "question": "What does Lock On do?", "pages": [379]}   ("id" and "pages" are optional)
+QUESTIONS_FILE = 'eval_questions.jsonl'
+EVAL_MODELS = [NHP.OLLAMA_MODEL]                # Every model is run over every question...
+EVAL_BUDGETS = [NHP.CONTEXT_TOKEN_BUDGET]       # ...at every retrieved-context token budget
+EVAL_CONCURRENCY = 2            # Questions sent to the model at the same time (match Ollama's OLLAMA_NUM_PARALLEL)
+EVAL_DIR = 'eval_results'       # Each run writes <timestamp>.jsonl (one line per answer) and <timestamp>.summary.json
+# ====================================
+
+# Page numbers an answer cites: "page 379", "p. 12", "pages 40-41", "pp. 40, 41 and 43"
+CITATION_PATTERN = re.compile(r'\b(?:pages?|pp?)\.?\s*(\d+(?:\s*(?:-|–|,|and|&)\s*\d+)*)', re.IGNORECASE)
+CONTEXT_PAGE_PATTERN = re.compile(r'\[Page: (\d+)\]')
+
+
+def load_questions(path: str) -> List[Dict]:
+    """[{"id", "question", "pages"}] from a .txt (one question per line) or .jsonl questions file."""
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            item = json.loads(line) if path.lower().endswith('.jsonl') else {'question': line}
+            if not item.get('question'):
+                raise ValueError(f"{path}:{n}: no question")
+            item.setdefault('id', str(n))
+            item['pages'] = [int(p) for p in item.get('pages') or []]
+            questions.append(item)
+    return questions
+
+
+def cited_pages(text: str) -> List[int]:
+    pages = set()
+    for match in CITATION_PATTERN.findall(text):
+        numbers = [int(x) for x in re.findall(r'\d+', match)]
+        if re.search(r'\d\s*[-–]\s*\d', match) and len(numbers) == 2 and 0 <= numbers[1] - numbers[0] <= 20:
+            numbers = list(range(numbers[0], numbers[1] + 1))
+        pages.update(numbers)
+    return sorted(pages)
+
+
+class RecordingClient:
+    """Passes chat() through to the real client, keeping the messages and response of the one question it serves."""
+
+    def __init__(self, client):
+        self.client = client
+        self.messages = []
+        self.response = None
+
+    def chat(self, model, messages, **kwargs):
+        self.messages = messages
+        self.response = self.client.chat(model=model, messages=messages, **kwargs)
+        return self.response
+
+
+def ask_one(ask, context: str, item: Dict, model: str, budget: int, client) -> Dict:
+    """Answer one question with a fresh (empty) memory and measure it."""
+    recorder = RecordingClient(client)
+    result = {'id': item['id'], 'question': item['question'], 'model': model, 'budget': budget}
+    start = time.perf_counter()
+    try:
+        answer, token_msg = ask(context, item['question'], [], model=model, client=recorder, context_budget=budget)
+    except Exception as e:
+        result.update(error=str(e), latency_ms=(time.perf_counter() - start) * 1000)
+        return result
+    result.update(answer=answer, token_msg=token_msg, latency_ms=(time.perf_counter() - start) * 1000)
+    result['model_call'] = recorder.response is not None
+    if recorder.response is not None:
+        result['input_tokens'] = NHP.count_message_tokens(recorder.messages)
+        result.update(server_timing(recorder.response))
+    if item['pages']:
+        expected = set(item['pages'])
+        cited = set(cited_pages(answer))
+        sent = ''.join(m['content'] for m in recorder.messages if m['role'] == 'system')
+        retrieved = {int(p) for p in CONTEXT_PAGE_PATTERN.findall(sent)}
+        result.update(
+            expected_pages=sorted(expected), cited_pages=sorted(cited),
+            citation_hit=bool(cited & expected),  # The answer cites at least one expected page
+            retrieval_recall=len(retrieved & expected) / len(expected),  # Expected pages that made it into the context
+        )
+    return result
+
+
+def summarize(results: List[Dict], seconds: float) -> Dict:
+    ok = [r for r in results if 'error' not in r]
+    latencies = [r['latency_ms'] for r in ok]
+    called = [r for r in ok if r.get('model_call')]
+    scored = [r for r in ok if 'citation_hit' in r]
+    eval_ns = sum(r.get('eval_duration', 0) for r in called)
+    summary = {
+        'questions': len(results), 'errors': len(results) - len(ok), 'seconds': seconds,
+        'questions_per_s': len(results) / seconds if seconds else 0.0,
+        'p50_ms': percentile(latencies, 0.5), 'p95_ms': percentile(latencies, 0.95),
+        'avg_input_tokens': sum(r['input_tokens'] for r in called) / len(called) if called else 0,
+        'gen_tok_s': sum(r.get('eval_count', 0) for r in called) / (eval_ns / 1e9) if eval_ns else None,
+    }
+    if scored:
+        summary['citation_accuracy'] = sum(r['citation_hit'] for r in scored) / len(scored)
+        summary['retrieval_recall'] = sum(r['retrieval_recall'] for r in scored) / len(scored)
+    return summary
+
+
+def run_eval(questions: List[Dict], models=EVAL_MODELS, budgets=EVAL_BUDGETS, concurrency=EVAL_CONCURRENCY, client=None, out_path=None, save_model_info=True) -> List[Dict]:
+    """
+    Run every question for every (model, budget) pair through ask_ollama, concurrency questions at a time.
+    Pairs run one after another so they don't compete for the model server. Returns one summary per pair.
+    save_model_info=False keeps the models' context lengths out of NHP.MODEL_INFO_FILE (for a fake client).
+    """
+    corpus = NHP.load_corpus()
+    ask = partial(corpus['ask_ollama'], response_cache=None)  # Every question must really reach the model
+    client = client or NHP.ollama_client()
+    summaries = []
+    out = open(out_path, 'w', encoding='utf-8') if out_path else None
+    try:
+        for model in models:
+            NHP.refresh_model_info(model, client, save=save_model_info)
+            for budget in budgets:
+                print(f"\n{model} @ {budget} context tokens: {len(questions)} questions, {concurrency} at a time")
+                run = partial(ask_one, ask, corpus['rag_context'], model=model, budget=budget, client=client)
+                start = time.perf_counter()
+                results = []
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    for result in pool.map(run, questions):
+                        results.append(result)
+                        status = f"ERROR {result['error']}" if 'error' in result else f"{result['latency_ms']:.0f} ms"
+                        if 'citation_hit' in result:
+                            status += ", cites expected page" if result['citation_hit'] else f", cited {result['cited_pages']}"
+                        print(f"  [{result['id']}] {status}")
+                        if out:
+                            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                            out.flush()
+                summary = {'model': model, 'budget': budget, **summarize(results, time.perf_counter() - start)}
+                summaries.append(summary)
+    finally:
+        if out:
+            out.close()
+    return summaries
+
+
+def print_summaries(summaries: List[Dict]):
+    print(f"\n{'model':<32}{'budget':>8}{'q/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'in tok':>9}{'gen tok/s':>11}{'cites':>8}{'recall':>8}{'errors':>8}")
+    for s in summaries:
+        gen = f"{s['gen_tok_s']:.1f}" if s['gen_tok_s'] else '-'
+        cites = f"{s['citation_accuracy']:.0%}" if 'citation_accuracy' in s else '-'
+        recall = f"{s['retrieval_recall']:.0%}" if 'retrieval_recall' in s else '-'
+        print(f"{s['model']:<32}{s['budget']:>8}{s['questions_per_s']:>8.2f}{s['p50_ms']:>10.0f}{s['p95_ms']:>10.0f}"
+              f"{s['avg_input_tokens']:>9.0f}{gen:>11}{cites:>8}{recall:>8}{s['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions unattended and compare models / context budgets.")
+    parser.add_argument('questions', nargs='?', default=QUESTIONS_FILE, help="Questions file (.txt or .jsonl)")
+    parser.add_argument('--models', nargs='+', default=EVAL_MODELS)
+    parser.add_argument('--budgets', nargs='+', type=int, default=EVAL_BUDGETS, help="Retrieved-context token budgets")
+    parser.add_argument('--concurrency', type=int, default=EVAL_CONCURRENCY)
+    parser.add_argument('--limit', type=int, help="Only the first N questions")
+    parser.add_argument('--fake', action='store_true', help="Answer with FakeOllama.FakeClient instead of a model server")
+    parser.add_argument('--fake-latency', type=float, default=0.5, help="Seconds each fake answer takes")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.questions):
+        parser.error(f"File not found: {args.questions}")
+    questions = load_questions(args.questions)[:args.limit]
+    client = None
+    if args.fake:
+        from FakeOllama import FakeClient
+        client = FakeClient(first_token_delay=args.fake_latency)
+    tracer.configure(NHP.TELEMETRY_FILE)
+    os.makedirs(EVAL_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    out_path = os.path.join(EVAL_DIR, f"{stamp}.jsonl")
+    try:
+        summaries = run_eval(questions, args.models, args.budgets, args.concurrency, client, out_path,
+                             save_model_info=not args.fake)
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        exit(1)
+    print_summaries(summaries)
+    with open(os.path.join(EVAL_DIR, f"{stamp}.summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, indent=2)
+    print(f"\nAnswers written to {out_path}")
+
+
+if __name__ == '__main__':
+    main()
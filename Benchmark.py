@@ -0,0 +1,273 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import NHP
+import TableExtractor
+import TextChunker
+import TextCleaner
+from ContextCompressor import compress
+from FakeOllama import FakeClient
+from Retriever import RetrievalIndex
+from Tokenizer import TokenCounter
+
+
+# === USER CONFIGURABLE PARAMETERS ===
+BENCH_TURNS = 8                 # Chat turns per session
+BENCH_CONTEXT_PARAGRAPHS = 200  # Size of the synthetic context (~25k tokens at 200)
+PROMPT_EVAL_DELAY = 0.00005     # Fake server cost per newly evaluated prompt token (seconds)
+IMPORT_RUNS = 5                 # Fresh interpreters started for the import-time benchmark
+MAX_IMPORT_MS = 250             # Importing NHP slower than this (best run) is reported as a regression
+# Modules that must not be imported by `import NHP`: they are slow to load and only needed later
+LAZY_MODULES = ['ollama', 'tkinter', 'tokenizers', 'numpy', 'sentence_transformers']
+# --- Suite: every case runs on synthetic books of each size in BENCH_PAGES ---
+BENCH_PAGES = [20, 200, 2000]
+BENCH_REPEAT = 3                # Timed runs per case (the best one counts); peak memory comes from one extra traced run
+BENCH_QUESTIONS = 20            # ask_ollama calls per ask_ollama case
+FAKE_LLM_LATENCY = 0.0          # Seconds the fake backend waits before answering (0 = measure our own code only)
+RESULTS_FILE = 'bench_results.json'
+THROUGHPUT_TOLERANCE = 0.15     # Compared to a baseline, throughput may drop this much before it counts as a regression
+MEMORY_TOLERANCE = 0.15         # ...and peak memory may grow this much
+# ====================================
+
+
+def synthetic_paragraphs(count):
+    """Rulebook-looking {header, page, paragraph} records for benchmarks."""
+    return [
+        {
+            'header': f"SECTION {i // 10}",
+            'page': 10 + i // 4,
+            'paragraph': (f"Rule {i}: when a mech with Heat Cap {i % 9 + 4} takes a Lock On, it gains {i % 3 + 1} Accuracy "
+                          "on its next attack, and may Overcharge as a quick action at the cost of 1d3 heat. ") * 3
+        }
+        for i in range(count)
+    ]
+
+
+def bench_prompt_prefix(turns=BENCH_TURNS, paragraphs=BENCH_CONTEXT_PARAGRAPHS):
+    """
+    Multi-turn chat against the fake server with a fixed context, reporting how many prompt tokens
+    had to be evaluated each turn. With a stable prefix only the first turn pays for the whole context.
+    """
+    client = FakeClient(prompt_eval_delay=PROMPT_EVAL_DELAY)
+    context = NHP.build_context(synthetic_paragraphs(paragraphs))
+    memory = []
+    results = []
+    for turn in range(turns):
+        question = f"Question {turn}: how does Lock On interact with Overcharge?"
+        start = time.perf_counter()
+        answer, token_msg = NHP.ask_ollama(context, question, memory, model='fake', client=client)
+        elapsed = time.perf_counter() - start
+        response = client.responses[-1]
+        results.append({
+            'turn': turn + 1,
+            'prompt_eval_count': response['prompt_eval_count'],
+            'prompt_eval_ms': response['prompt_eval_duration'] / 1e6,
+            'total_ms': elapsed * 1000,
+        })
+        memory.append({"role": "user", "content": question})
+        memory.append({"role": "assistant", "content": answer})
+    return results
+
+
+# --- Suite ---
+WORDS = ("mech pilot heat accuracy difficulty range threat overcharge structure stress armor evasion sensors "
+         "systems hull agility engineering reaction quick full action protocol talent license frame core bonus").split()
+
+def synthetic_book(pages, seed=0):
+    """
+    Extracted-book-looking text: a [N] marker per page, ALL-CAPS headers, prose paragraphs and a statblock
+    table every fourth page. Seeded, so the same size always produces the same text.
+    """
+    rng = random.Random(seed)
+    out = []
+    for page in range(1, pages + 1):
+        out.append(f"[{page}]")
+        if page % 3 == 1:
+            out.append(f"SECTION {page // 3} {rng.choice(WORDS).upper()}")
+        for _ in range(rng.randint(3, 6)):
+            out.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))).capitalize() + '.')
+            out.append('')
+        if page % 4 == 0:
+            out.append(f"Mech {page}")
+            out.append(TableExtractor.Table.strip('\n'))
+            out.append('')
+    return '\n'.join(out) + '\n'
+
+def suite_cases(pages, work_dir, llm_latency=FAKE_LLM_LATENCY, questions=BENCH_QUESTIONS):
+    """{case name: (run, units per run, unit)} for one book size; all setup happens here, outside the timings."""
+    text = synthetic_book(pages)
+    txt_path = os.path.join(work_dir, f"book{pages}.txt")
+    jsonl_path = os.path.join(work_dir, f"book{pages}.jsonl")
+    with open(txt_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    paragraphs = TextChunker.parse_paragraphs(text)
+    texts = [p['paragraph'] for p in paragraphs]
+    tables = pages // 4 or 1
+    counter = TokenCounter(NHP.TOKENIZER_FILE if os.path.exists(NHP.TOKENIZER_FILE) else None)
+    counter.count('warm up')  # Load the tokenizer outside the timing
+
+    def count_tokens_cold():
+        counter.cache.clear()
+        for t in texts:
+            counter.count(t)
+
+    retriever = RetrievalIndex(paragraphs)
+    search_questions = [f"What happens with {WORDS[i % len(WORDS)]} and Lock On?" for i in range(questions)]
+    selected = [(q, retriever.select(q, NHP.CONTEXT_TOKEN_BUDGET)) for q in search_questions]
+    client = FakeClient(first_token_delay=llm_latency)
+    history = [{"role": "user", "content": "What is Lock On?"}, {"role": "assistant", "content": client.reply}] * 3
+
+    def ask():
+        for i in range(questions):
+            NHP.ask_ollama('', f"How does {WORDS[i % len(WORDS)]} interact with overcharge?", history,
+                           model='fake', retriever=retriever, client=client)
+
+    return {
+        'chunk_text.by_page': (lambda: TextCleaner.chunk_text(text, by_page=True), pages, 'pages'),
+        'chunk_text.paragraph': (lambda: TextCleaner.chunk_text(text, TextCleaner.CHUNK_SIZE, by_page=False), pages, 'pages'),
+        'parse_output_txt': (lambda: TextChunker.parse_output_txt(txt_path, jsonl_path), pages, 'pages'),
+        'JSONifyTable': (lambda: [TableExtractor.JSONifyTable(f"Mech {i}", TableExtractor.Table) for i in range(tables)], tables, 'tables'),
+        'build_context': (lambda: NHP.build_context(paragraphs), len(paragraphs), 'paragraphs'),
+        'count_tokens': (count_tokens_cold, len(texts), 'paragraphs'),
+        'RetrievalIndex': (lambda: RetrievalIndex(paragraphs), len(paragraphs), 'paragraphs'),
+        'search': (lambda: [retriever.search(q) for q in search_questions], questions, 'questions'),
+        'compress': (lambda: [compress(records, q, NHP.COMPRESSED_CONTEXT_TOKENS, idf=retriever.idf) for q, records in selected], questions, 'questions'),
+        'ask_ollama': (ask, questions, 'questions'),
+    }
+
+def measure(run, repeat=BENCH_REPEAT):
+    """(best wall time in seconds, peak traced memory in bytes) for one case."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    # tracemalloc slows everything down, so memory gets its own run
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+def run_suite(page_counts=BENCH_PAGES, repeat=BENCH_REPEAT, only=None, llm_latency=FAKE_LLM_LATENCY):
+    """Run every case at every size; returns {"meta", "results": {"case@pages": {...}}}."""
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for pages in page_counts:
+            for name, (run, units, unit) in suite_cases(pages, work_dir, llm_latency).items():
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                seconds, peak = measure(run, repeat)
+                results[f"{name}@{pages}"] = {
+                    'case': name, 'pages': pages, 'seconds': seconds,
+                    'throughput': units / seconds if seconds else float('inf'), 'unit': f"{unit}/s", 'peak_kb': peak / 1024,
+                }
+                r = results[f"{name}@{pages}"]
+                print(f"  {name + '@' + str(pages):<28}{seconds * 1000:>10.1f} ms{r['throughput']:>14.0f} {r['unit']:<14}{r['peak_kb']:>10.0f} KB peak")
+    meta = {
+        'python': platform.python_version(), 'platform': platform.platform(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'pages': list(page_counts), 'repeat': repeat, 'llm_latency': llm_latency,
+    }
+    return {'meta': meta, 'results': results}
+
+def compare(current, baseline, throughput_tolerance=THROUGHPUT_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """Regression messages for every case that got slower or bigger than the baseline allows."""
+    regressions = []
+    for key, r in current['results'].items():
+        b = baseline['results'].get(key)
+        if b is None:
+            continue
+        if r['throughput'] < b['throughput'] * (1 - throughput_tolerance):
+            regressions.append(f"{key}: throughput {r['throughput']:.0f} {r['unit']} vs baseline {b['throughput']:.0f} "
+                               f"({(r['throughput'] / b['throughput'] - 1) * 100:+.0f}%)")
+        if r['peak_kb'] > b['peak_kb'] * (1 + memory_tolerance) and r['peak_kb'] - b['peak_kb'] > 64:
+            regressions.append(f"{key}: peak memory {r['peak_kb']:.0f} KB vs baseline {b['peak_kb']:.0f} KB "
+                               f"({(r['peak_kb'] / b['peak_kb'] - 1) * 100:+.0f}%)")
+    return regressions
+
+
+IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import NHP
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "loaded": [m for m in json.loads(sys.argv[1]) if m in sys.modules]}))
+'''
+
+def bench_import(runs=IMPORT_RUNS):
+    """
+    Time `import NHP` in fresh interpreters (nothing cached in sys.modules), and check it stays free of
+    blocking work: no Ollama round trip and none of LAZY_MODULES loaded.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', IMPORT_PROBE, json.dumps(LAZY_MODULES)], cwd=here,
+                             capture_output=True, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        times.append(result['ms'])
+        loaded.update(result['loaded'])
+    return {'best_ms': min(times), 'median_ms': sorted(times)[len(times) // 2], 'eager_modules': sorted(loaded)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NHP benchmark suite (fake Ollama backend, synthetic books).")
+    parser.add_argument('--pages', type=int, nargs='+', default=BENCH_PAGES, help="Book sizes to run every case at")
+    parser.add_argument('--repeat', type=int, default=BENCH_REPEAT, help="Timed runs per case (best counts)")
+    parser.add_argument('--only', nargs='+', help="Only cases whose name starts with one of these")
+    parser.add_argument('--llm-latency', type=float, default=FAKE_LLM_LATENCY, help="Fake backend delay per call (seconds)")
+    parser.add_argument('--out', default=RESULTS_FILE, help="Where to write the results JSON")
+    parser.add_argument('--baseline', help="Compare against this results file; exit 1 on regressions")
+    parser.add_argument('--save-baseline', help="Also write the results to this file, for later --baseline runs")
+    parser.add_argument('--prefix', action='store_true', help="Also run the multi-turn prompt-prefix benchmark")
+    args = parser.parse_args()
+
+    regressions = []
+    startup = bench_import()
+    print(f"Import NHP: best {startup['best_ms']:.1f} ms, median {startup['median_ms']:.1f} ms over {IMPORT_RUNS} runs")
+    if startup['eager_modules']:
+        regressions.append(f"import NHP: imported at startup: {', '.join(startup['eager_modules'])}")
+    if startup['best_ms'] > MAX_IMPORT_MS:
+        regressions.append(f"import NHP: {startup['best_ms']:.0f} ms, slower than {MAX_IMPORT_MS} ms")
+
+    if args.prefix:
+        print("Prompt evaluation per turn (fake server with prefix reuse):")
+        for r in bench_prompt_prefix():
+            print(f"  turn {r['turn']:>2}: {r['prompt_eval_count']:>6} new prompt tokens, "
+                  f"{r['prompt_eval_ms']:8.1f} ms prompt eval, {r['total_ms']:8.1f} ms total")
+
+    print("Suite:")
+    current = run_suite(args.pages, args.repeat, args.only, args.llm_latency)
+    current['startup'] = startup
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions += compare(current, json.load(f))
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if args.baseline:
+        print(f"{len(regressions)} regressions against {args.baseline}" if regressions else f"No regressions against {args.baseline}")
+    if regressions:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
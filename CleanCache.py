@@ -0,0 +1,74 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class CleanCache:
+    """
+    SQLite cache of LLM cleaning results, keyed by a hash of (chunk, prompt, model, options).
+    Once the stored text passes max_bytes, the least recently used entries are evicted.
+    Safe to share between the cleaning worker threads.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cleaned ("
+            "key TEXT PRIMARY KEY, cleaned TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cleaned_last_used ON cleaned (last_used)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cleaned").fetchone()[0]
+
+    @staticmethod
+    def make_key(chunk: str, prompt: str, model: str, options: dict = None) -> str:
+        payload = json.dumps([chunk, prompt, model, options or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Cleaned text for key, or None on a miss."""
+        with self.lock:
+            row = self.conn.execute("SELECT cleaned FROM cleaned WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE cleaned SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, cleaned: str):
+        size = len(cleaned.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM cleaned WHERE key = ?", (key,)).fetchone()
+            if old:
+                self.total_bytes -= old[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cleaned (key, cleaned, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, cleaned, size, time.time())
+            )
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # Drop least recently used entries until we are back under the size limit
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM cleaned ORDER BY last_used"):
+            if self.total_bytes <= self.max_bytes:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM cleaned WHERE key = ?", doomed)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,108 @@
+import re
+from collections import namedtuple
+from typing import Callable, Dict, List
+
+from Retriever import PHRASE_WEIGHT, estimate_tokens, format_paragraph, phrases, tokenize
+from TextChunker import TABLE_LINE_PATTERN
+
+
+# Lines that carry nothing wherever they appear: bare page numbers, running heads, "continued" notes, separator rules
+BOILERPLATE_PATTERN = re.compile(
+    r'^\s*(?:\[?\d+\]?|page \d+(?: of \d+)?|lancer(?: core (?:rule)?book)?|\(?continued(?: on next page)?\)?|[-=_*•.]+)\s*$',
+    re.IGNORECASE
+)
+# Sentence boundary: end punctuation followed by whitespace and something that can start a sentence
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'(\[])')
+GAP = '[...]'  # Marks text left out between two kept sentences of the same block
+
+# One piece of a block the compressor keeps or drops as a whole: a sentence, or a table (all its lines)
+Unit = namedtuple('Unit', ['text', 'line', 'table'])
+
+
+def merge_adjacent(records: List[Dict]) -> List[Dict]:
+    """Join consecutive records with the same header and page into one, so they share one citation prefix."""
+    merged = []
+    for record in records:
+        last = merged[-1] if merged else None
+        if last is not None and last.get('header') == record.get('header') and last.get('page') == record.get('page'):
+            last['paragraph'] += '\n' + record.get('paragraph', '')
+        else:
+            merged.append({'header': record.get('header'), 'page': record.get('page'), 'paragraph': record.get('paragraph', '')})
+    return merged
+
+
+def split_units(text: str) -> List[Unit]:
+    """Sentences of the prose lines and whole tables, in order; line is the source line a unit starts on."""
+    units = []
+    table = []
+    for n, line in enumerate(text.split('\n')):
+        if TABLE_LINE_PATTERN.match(line):
+            table.append(line)
+            continue
+        if table:
+            units.append(Unit('\n'.join(table), n - len(table), True))
+            table = []
+        for sentence in SENTENCE_END_PATTERN.split(line.strip()):
+            if sentence:
+                units.append(Unit(sentence, n, False))
+    if table:
+        units.append(Unit('\n'.join(table), n - len(table) + 1, True))
+    return units
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def compress(records: List[Dict], question: str, token_budget: int, count_tokens: Callable[[str], int] = estimate_tokens,
+             idf: Callable[[str], float] = None) -> str:
+    """
+    Context for question from retrieved records (in book order), kept under token_budget: same-place records are
+    merged, repeated and boilerplate lines dropped, and only the sentences (or tables) sharing the most
+    question terms kept, weighted by idf. Every block keeps its [Header] [Page] prefix, so citations survive.
+    """
+    idf = idf or (lambda term: 1.0)
+    weights = {term: idf(term) for term in tokenize(question)}
+    weights.update({phrase: idf(phrase) * PHRASE_WEIGHT for phrase in phrases(question)})
+    blocks = []  # (prefix, units)
+    candidates = []  # (score, block index, unit index)
+    seen = set()
+    for record in merge_adjacent(records):
+        units = []
+        for unit in split_units(record['paragraph']):
+            key = normalize(unit.text)
+            if not key or key in seen or (not unit.table and BOILERPLATE_PATTERN.match(unit.text)):
+                continue
+            seen.add(key)
+            terms = set(tokenize(unit.text)) | set(phrases(unit.text))
+            candidates.append((sum(w for term, w in weights.items() if term in terms), len(blocks), len(units)))
+            units.append(unit)
+        if units:
+            blocks.append((format_paragraph({**record, 'paragraph': ''}), units))
+
+    # Best units first; a block with nothing relevant keeps its first unit if there is room, so its citation stays
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+    relevant = {b for score, b, _ in candidates if score > 0}
+    order = [c for c in candidates if c[0] > 0] + [c for c in candidates if c[1] not in relevant and c[2] == 0]
+    chosen: Dict[int, List[int]] = {}  # block -> kept unit indices
+    remaining = token_budget
+    for _, b, u in order:
+        cost = count_tokens(blocks[b][1][u].text) + 1
+        if b not in chosen:
+            cost += count_tokens(blocks[b][0])
+        if cost > remaining:
+            continue
+        chosen.setdefault(b, []).append(u)
+        remaining -= cost
+
+    parts = []
+    for b in sorted(chosen):
+        prefix, units = blocks[b]
+        kept = sorted(chosen[b])
+        text = units[kept[0]].text
+        for previous, u in zip(kept, kept[1:]):
+            gap = f" {GAP}" if u != previous + 1 else ''
+            same_line = not units[u].table and not units[previous].table and units[u].line == units[previous].line
+            text += gap + (' ' if same_line else '\n') + units[u].text
+        parts.append(prefix + text)
+    return '\n\n'.join(parts)
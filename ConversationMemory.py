@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+from typing import Callable, Dict, List
+
+from Tokenizer import MESSAGE_OVERHEAD, estimate_tokens
+
+SUMMARY_HEADING = "Summary of the earlier conversation with your pilot:\n"
+
+
+class ConversationMemory:
+    """
+    Chat history kept as an append-only JSONL log: one line per message, plus a {"summary", "covers"} line
+    every time older turns are compacted. The full transcript stays available for display, but the model
+    only gets prompt_history(): the running summary and the most recent turns, together within token_budget.
+    Compaction (an LLM call) runs on a background thread, never on the caller's.
+    """
+
+    def __init__(self, path: str, summarize: Callable[[str, List[Dict]], str] = None, keep_turns: int = 6,
+                 token_budget: int = 4000, count_tokens: Callable[[str], int] = estimate_tokens, legacy_path: str = None):
+        self.path = path
+        self.summarize = summarize  # (current summary, messages to fold in) -> new summary
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.messages: List[Dict] = []
+        self.summary = ''
+        self.summarized = 0  # How many of the oldest messages the summary covers
+        self.unsaved = 0  # Messages appended since the last flush()
+        self.lock = threading.RLock()
+        self.compacting = False
+        self.forgotten = False  # Set by forget(): nothing is written to path any more
+        if os.path.exists(path):
+            self._load()
+        elif legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Half-written line from a crash
+                if 'summary' in entry:
+                    self.summary = entry['summary']
+                    self.summarized = entry['covers']
+                else:
+                    self.messages.append(entry)
+
+    def _import_legacy(self, legacy_path):
+        # Old memory files were a single JSON list rewritten after every message
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                self.messages = json.load(f)
+        except Exception:
+            return
+        self.unsaved = len(self.messages)
+        self.flush()
+
+    def __iter__(self):
+        return iter(list(self.messages))
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __getitem__(self, i):
+        return self.messages[i]
+
+    def append(self, message: Dict):
+        with self.lock:
+            self.messages.append({"role": message['role'], "content": message['content']})
+            self.unsaved += 1
+
+    def flush(self):
+        """Append unsaved messages to the log file."""
+        with self.lock:
+            if not self.unsaved or self.forgotten:
+                return
+            new = self.messages[-self.unsaved:]
+            self.unsaved = 0
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for m in new:
+                    f.write(json.dumps(m, ensure_ascii=False) + '\n')
+
+    def forget(self):
+        """Delete the log file. A compaction still running drops its summary instead of recreating the file."""
+        with self.lock:
+            self.forgotten = True
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def prompt_history(self) -> List[Dict]:
+        """
+        Summary of older turns plus the recent ones verbatim, within token_budget in total (MESSAGE_OVERHEAD per
+        message included). The summary gets at most half of it (cut short if the summarizer ran long); recent turns
+        fill the rest, newest first. Turns are kept or dropped whole, so a reply never loses the question it answers.
+        """
+        with self.lock:
+            start = max(self.summarized, len(self.messages) - 2 * self.keep_turns)
+            recent = self.messages[start:]
+            summary = self.summary
+        history = []
+        budget = self.token_budget
+        if summary:
+            content = self._fit_summary(summary, self.token_budget // 2 - MESSAGE_OVERHEAD)
+            if content:
+                history.append({"role": "system", "content": content})
+                budget -= self.count_tokens(content) + MESSAGE_OVERHEAD
+        # A turn is a user message and the replies after it
+        turns = []
+        for m in recent:
+            if m['role'] == 'user' or not turns:
+                turns.append([])
+            turns[-1].append(m)
+        kept = []
+        for turn in reversed(turns):
+            budget -= sum(self.count_tokens(m['content']) + MESSAGE_OVERHEAD for m in turn)
+            if budget < 0:
+                break
+            kept[:0] = turn
+        return history + kept
+
+    def _fit_summary(self, summary: str, limit: int) -> str:
+        # Drop words from the end until the summary message fits in limit tokens ('' if not even the heading fits)
+        content = SUMMARY_HEADING + summary
+        tokens = self.count_tokens(content)
+        while tokens > limit and summary:
+            summary = summary[:len(summary) * limit // tokens].rsplit(' ', 1)[0] if ' ' in summary else ''
+            content = f"{SUMMARY_HEADING}{summary} [...]"
+            tokens = self.count_tokens(content)
+        return content if tokens <= limit else ''
+
+    def maybe_compact(self):
+        """Start a background summary of turns that fell out of the verbatim window, if there are any."""
+        with self.lock:
+            upto = len(self.messages) - 2 * self.keep_turns
+            if self.summarize is None or self.compacting or upto <= self.summarized:
+                return
+            self.compacting = True
+            summary = self.summary
+            batch = self.messages[self.summarized:upto]
+        threading.Thread(target=self._compact, args=(summary, batch, upto), daemon=True).start()
+
+    def _compact(self, summary, batch, upto):
+        try:
+            new_summary = self.summarize(summary, batch)
+        except Exception as e:
+            print(f"Failed to summarize conversation memory: {e}")
+            new_summary = None
+        with self.lock:
+            if new_summary and not self.forgotten:
+                self.summary = new_summary
+                self.summarized = upto
+                self.flush()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({"summary": new_summary, "covers": upto}, ensure_ascii=False) + '\n')
+            self.compacting = False
@@ -0,0 +1,235 @@
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from TextChunker import iter_paragraphs
+
+
+MAGIC = b'NHPCORPUS1\n'
+NO_VALUE = -1  # Stored header id / page for records without one
+
+
+class Corpus(Sequence):
+    """
+    Compact store of {header, page, paragraph} records. All paragraph text lives in one UTF-8 buffer,
+    headers are stored once and referenced by id, and header ids, pages and text offsets are flat arrays,
+    so a record costs a few bytes of bookkeeping instead of a dict and three string objects.
+    Records (and their formatted context) are only built when asked for.
+
+    Corpus.open() caches the store next to its source file (<file>.corpus) and memory-maps the text on
+    later runs, so the paragraph text never has to be loaded into Python at all.
+    """
+
+    def __init__(self):
+        self.headers: List[str] = []
+        self.header_ids: Dict[str, int] = {}
+        self.header_of = array('i')
+        self.pages = array('i')
+        self.offsets = array('q', [0])  # offsets[i]:offsets[i + 1] is paragraph i's slice of text
+        self.text = bytearray()  # A read-only memoryview of the mapped cache file once loaded
+        self._page_rows = None
+
+    # --- Building ---
+    def append(self, record: Dict):
+        header = record.get('header')
+        if header:
+            header_id = self.header_ids.get(header)
+            if header_id is None:
+                header_id = self.header_ids[header] = len(self.headers)
+                self.headers.append(header)
+        else:
+            header_id = NO_VALUE
+        page = record.get('page')
+        self.header_of.append(header_id)
+        self.pages.append(NO_VALUE if page is None else page)
+        self.text += record.get('paragraph', '').encode('utf-8')
+        self.offsets.append(len(self.text))
+        self._page_rows = None
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> 'Corpus':
+        corpus = cls()
+        for record in records:
+            corpus.append(record)
+        return corpus
+
+    @classmethod
+    def from_file(cls, path: str) -> 'Corpus':
+        """Build from a JSONL file of records or a cleaned .txt file (parsed like TextChunker), streaming."""
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.lower().endswith('.jsonl'):
+                return cls.from_records(json.loads(line) for line in f if line.strip())
+            return cls.from_records(iter_paragraphs(f))
+
+    @classmethod
+    def open(cls, path: str, cache: bool = True) -> 'Corpus':
+        """Corpus for a .jsonl/.txt file, from its <file>.corpus cache when that is up to date (rebuilt otherwise)."""
+        cache_path = path + '.corpus'
+        stamp = _stamp(path)
+        if cache and os.path.exists(cache_path):
+            corpus = cls._load(cache_path, stamp)
+            if corpus is not None:
+                return corpus
+        corpus = cls.from_file(path)
+        if cache:
+            corpus.save(cache_path, stamp)
+        return corpus
+
+    # --- Cache file (see save_store): header ids, pages and offsets, then the mapped text ---
+    def save(self, cache_path: str, stamp=None) -> bool:
+        meta = {'stamp': stamp, 'count': len(self), 'headers': self.headers}
+        return save_store(cache_path, MAGIC, meta, [self.header_of, self.pages, self.offsets, memoryview(self.text)[:self.offsets[-1]]])
+
+    @classmethod
+    def _load(cls, cache_path: str, stamp):
+        count = lambda meta: [('i', meta['count']), ('i', meta['count']), ('q', meta['count'] + 1)]
+        loaded = load_store(cache_path, MAGIC, count)
+        if loaded is None or loaded[0]['stamp'] != stamp:
+            return None  # The source changed since the cache was written
+        meta, (header_of, pages, offsets), text = loaded
+        corpus = cls()
+        corpus.headers = meta['headers']
+        corpus.header_ids = {header: i for i, header in enumerate(corpus.headers)}
+        corpus.header_of, corpus.pages, corpus.offsets = header_of, pages, offsets
+        if text is not None:
+            corpus.text = text
+        return corpus
+
+    def close(self):
+        # Releasing the view unmaps the cache file, so it can be replaced (Windows won't while it is mapped)
+        if isinstance(self.text, memoryview):
+            self.text.release()
+            self.text = bytearray()
+
+    # --- Reading ---
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def paragraph(self, row: int) -> str:
+        return str(self.text[self.offsets[row]:self.offsets[row + 1]], 'utf-8')
+
+    def header(self, row: int):
+        header_id = self.header_of[row]
+        return None if header_id == NO_VALUE else self.headers[header_id]
+
+    def page(self, row: int):
+        page = self.pages[row]
+        return None if page == NO_VALUE else page
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return {'header': self.header(row), 'page': self.page(row), 'paragraph': self.paragraph(row)}
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def rows_for_page(self, page: int) -> List[int]:
+        if self._page_rows is None:
+            self._page_rows = {}
+            for row, p in enumerate(self.pages):
+                self._page_rows.setdefault(p, []).append(row)
+        return self._page_rows.get(page, [])
+
+
+class ChainedRecords(Sequence):
+    """Several record sources (Corpus objects or plain lists) seen as one sequence, with global row numbers."""
+
+    def __init__(self, sources: List[Sequence]):
+        self.sources = sources
+        self.starts = []
+        total = 0
+        for source in sources:
+            self.starts.append(total)
+            total += len(source)
+        self.total = total
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += self.total
+        for start, source in zip(reversed(self.starts), reversed(self.sources)):
+            if row >= start:
+                return source[row - start]
+        raise IndexError(row)
+
+    def __iter__(self):
+        for source in self.sources:
+            yield from source
+
+    def rows_for_page(self, page: int) -> List[int]:
+        rows = []
+        for start, source in zip(self.starts, self.sources):
+            if hasattr(source, 'rows_for_page'):
+                rows.extend(start + row for row in source.rows_for_page(page))
+            else:
+                rows.extend(start + row for row, p in enumerate(source) if p.get('page') == page)
+        return rows
+
+
+def _stamp(path: str):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# --- Store files, shared by the Corpus cache and Retriever's saved index ---
+# Layout: magic, 8-byte meta length, meta JSON (padded so what follows is 8-byte aligned), then the parts as raw bytes.
+def save_store(path: str, magic: bytes, meta: Dict, parts: Iterable) -> bool:
+    """
+    Write meta and parts (arrays or bytes-like objects) to path. The file is swapped in whole, so a reader never
+    sees half of it. Returns False if path can't be written (e.g. a read-only location: just rebuild next time).
+    """
+    data = json.dumps({**meta, 'byteorder': sys.byteorder}).encode('utf-8')
+    data += b' ' * (-(len(magic) + 8 + len(data)) % 8)
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(magic)
+            f.write(len(data).to_bytes(8, 'little'))
+            f.write(data)
+            for part in parts:
+                f.write(part)
+        os.replace(tmp_path, path)
+    except OSError:
+        return False
+    return True
+
+
+def load_store(path: str, magic: bytes, layout: Callable[[Dict], List[Tuple[str, int]]]) -> Optional[Tuple[Dict, List[array], Optional[memoryview]]]:
+    """
+    (meta, arrays, rest) of a file written by save_store, or None if it is missing, damaged or from a machine with
+    another byte order. layout(meta) gives the (typecode, count) of the arrays at the start, which are read into
+    memory; the rest of the file is memory-mapped and returned as a read-only memoryview (None if empty).
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                return None
+            meta = json.loads(f.read(int.from_bytes(f.read(8), 'little')))
+            if meta['byteorder'] != sys.byteorder:
+                return None
+            arrays = []
+            for typecode, count in layout(meta):
+                values = array(typecode)
+                values.fromfile(f, count)
+                arrays.append(values)
+            offset = f.tell()
+            rest = None
+            if os.fstat(f.fileno()).st_size > offset:
+                rest = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[offset:]
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+    return meta, arrays, rest
@@ -0,0 +1,76 @@
+import time
+
+
+DEFAULT_REPLY = "Pilot, the answer you are looking for is on page 379 of the core book. Lock On grants +1 Accuracy to the next attack against the target."
+
+
+class FakeClient:
+    """
+    Local stand-in for the ollama module, for running the chat path without a model server.
+    chat() returns the canned reply (or yields it in chunks when stream=True), waiting
+    first_token_delay seconds before the first chunk and chunk_delay seconds between chunks.
+
+    Like the real server, it keeps the previous prompt "evaluated": only the part of a new prompt after
+    the prefix it shares with the last one is counted in prompt_eval_count, and each of those tokens
+    adds prompt_eval_delay seconds before the first chunk.
+    """
+
+    def __init__(self, reply: str = DEFAULT_REPLY, chunk_size: int = 8, first_token_delay: float = 0.0, chunk_delay: float = 0.0, context_length: int = 32768, prompt_eval_delay: float = 0.0):
+        self.reply = reply
+        self.chunk_size = chunk_size  # Characters per streamed chunk
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.context_length = context_length
+        self.prompt_eval_delay = prompt_eval_delay
+        self.calls = []  # Every chat() call's keyword arguments, for inspection
+        self.responses = []  # Final response of every chat() call, including the timing fields
+        self.last_prompt = ''
+
+    def chunks(self):
+        return [self.reply[i:i + self.chunk_size] for i in range(0, len(self.reply), self.chunk_size)]
+
+    def _evaluate_prompt(self, messages):
+        # Render the prompt roughly like a chat template, then find how much of it the last call already covered
+        prompt = ''.join(f"<{m['role']}>{m['content']}</{m['role']}>" for m in messages)
+        shared = 0
+        for a, b in zip(prompt, self.last_prompt):
+            if a != b:
+                break
+            shared += 1
+        self.last_prompt = prompt
+        new_tokens = max((len(prompt) - shared) // 4, 1)
+        delay = new_tokens * self.prompt_eval_delay
+        return {'prompt_eval_count': new_tokens, 'prompt_eval_duration': int(delay * 1e9)}, delay
+
+    def _final(self, model, content, timings):
+        chunks = len(self.chunks())
+        response = {
+            'model': model, 'message': {'role': 'assistant', 'content': content}, 'done': True,
+            'eval_count': max(len(self.reply) // 4, 1),
+            'eval_duration': int((self.first_token_delay + self.chunk_delay * max(chunks - 1, 0)) * 1e9),
+            **timings,
+        }
+        self.responses.append(response)
+        return response
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.calls.append(dict(model=model, messages=messages, stream=stream, **kwargs))
+        timings, eval_delay = self._evaluate_prompt(messages)
+        if stream:
+            return self._stream(model, timings, eval_delay)
+        time.sleep(eval_delay + self.first_token_delay + self.chunk_delay * max(len(self.chunks()) - 1, 0))
+        return self._final(model, self.reply, timings)
+
+    def _stream(self, model, timings, eval_delay):
+        time.sleep(eval_delay + self.first_token_delay)
+        for i, chunk in enumerate(self.chunks()):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield {'model': model, 'message': {'role': 'assistant', 'content': chunk}, 'done': False}
+        yield self._final(model, '', timings)
+
+    def show(self, model):
+        return {'model_info': {'fake.context_length': self.context_length}}
+
+    def list(self):
+        return {'models': [{'model': 'fake:latest', 'digest': 'fake'}]}
@@ -0,0 +1,24 @@
+# Private-use glyphs the LANCER PDFs draw game icons with, and the words pymupdf4llm output gets instead.
+# Shared by PDF Extractor.py (which translates them) and OcrDamage.py (which flags any it doesn't know).
+GlyphMap = {
+    # Damage Types
+    "": "Kinetic",
+    "": "Explosive",
+    "": "Energy",
+    "": "Burn",
+    "": "Heat",
+    # Ranges
+    "": "Range",
+    "": "Threat",
+    # Area Shapes
+    "": "Blast",
+    "": "Burst",
+    "": "Line",
+    "": "Cone",
+    # Accuracy/Difficulty
+    "": "Accuracy",
+    "": "Difficulty"
+}
+
+# Every glyph is a single private-use character, so one str.translate pass replaces all of them
+GlyphTable = str.maketrans(GlyphMap)
@@ -1,13 +1,19 @@
-
-
-
 import json
-import ollama
 import os
+import threading
+import time
+from functools import partial
 from typing import List, Dict
-# GUI code moved to Window.py
+# GUI code moved to Window.py (imported in __main__, so Server.py and benchmarks don't load tkinter)
 
-from Window import start_gui
+from Retriever import RetrievalIndex, format_paragraph
+from ContextCompressor import compress
+from Corpus import ChainedRecords, Corpus
+from Tokenizer import TokenCounter, MESSAGE_OVERHEAD
+from ConversationMemory import ConversationMemory
+from StatStore import StatStore
+from ResponseCache import ResponseCache, is_cacheable
+from Telemetry import tracer, server_timing
 
 
 
@@ -17,12 +23,63 @@ CONTEXT_FILES = [
     'Output NHP.txt',
     'output3 (clipped).txt'
 ]
-MEMORY_FILE = 'nhp_conversation_memory.json'  # Conversation memory file
+MEMORY_FILE = 'nhp_conversation_memory.jsonl'  # Conversation memory file (append-only log)
+LEGACY_MEMORY_FILE = 'nhp_conversation_memory.json'  # Old single-JSON memory file, imported once if MEMORY_FILE doesn't exist yet
+# --- Memory: the last MEMORY_KEEP_TURNS turns are sent verbatim, older ones are folded into a running summary ---
+MEMORY_KEEP_TURNS = 6
+HISTORY_TOKEN_BUDGET = 4000  # Hard cap on tokens of summary + history sent with each question
 OLLAMA_MODEL = 'qwen2.5:7b-instruct-q4_K_M' # Ollama model name
+# Hugging Face tokenizer.json for OLLAMA_MODEL (needs the `tokenizers` package). None or missing file = estimate 4 chars/token.
+TOKENIZER_FILE = 'tokenizer.json'
+# The model's context length is looked up in the background and remembered here, keyed by the model's digest,
+# so startup never waits on Ollama. Until the first lookup finishes, DEFAULT_CONTEXT_LENGTH is assumed.
+MODEL_INFO_FILE = 'nhp_model_info.json'
+MODEL_INFO_TIMEOUT = 10  # Seconds to wait for Ollama when looking up model info
+DEFAULT_CONTEXT_LENGTH = 32768
+# Sent with every chat request. num_ctx is always set to the model's full context (Ollama's default is much smaller);
+# keep_alive keeps the model, and its cached prompt, loaded between turns.
+OLLAMA_OPTIONS = {}
+OLLAMA_KEEP_ALIVE = '30m'
+
+# --- Retrieval: if True, only the paragraphs most relevant to each question are sent to the model ---
+RETRIEVAL_MODE = True
+CONTEXT_TOKEN_BUDGET = 6000  # Max tokens of retrieved context per question
+# Keyword (BM25) index, saved here and reloaded instantly while CONTEXT_FILES are unchanged. None = rebuild every start.
+RETRIEVAL_INDEX_FILE = 'nhp_retrieval.index'
+# Compression: the retrieved paragraphs are cut down to the sentences (and tables) that share terms with the question,
+# with same-section paragraphs merged and repeated lines dropped, to at most this many tokens. None = send them whole.
+COMPRESSED_CONTEXT_TOKENS = 3000
+# Embedding search: ranks paragraphs by sentence-transformers similarity instead of keywords.
+# Embeddings are cached in EMBEDDING_STORE_DIR, so only new or edited paragraphs get encoded on startup.
+USE_EMBEDDINGS = False
+EMBEDDING_STORE_DIR = 'nhp_embeddings'
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+# With embeddings: 'hybrid' fuses keyword and embedding rankings (exact rules terms like "Lock On" still count),
+# 'vector' ranks by embeddings alone, 'lexical' ignores them
+RETRIEVAL_RANKING = 'hybrid'
+
+# --- Stat tables: questions naming a mech/NPC and a stat (e.g. "Ace's evasion at tier 3") skip the full model round trip ---
+STAT_FILES = ['Table.json', 'StatBlocks.jsonl']  # TableExtractor output; missing files are skipped
+STAT_ANSWER_MODE = 'direct'  # 'direct' = answer straight from the table, 'inject' = only add that row to the context, None = off
+
+# --- Response cache: repeated standalone questions (same wording, same context, same model) are answered from memory ---
+# Questions that lean on the conversation ("what do you think of it?") always go to the model.
+RESPONSE_CACHE = True
+RESPONSE_CACHE_SIZE = 256  # Max cached answers (least recently used are dropped first)
+RESPONSE_CACHE_TTL = 6 * 3600  # Seconds before a cached answer expires
+# With USE_EMBEDDINGS, differently worded questions at least this similar also hit the cache. None = exact wording only.
+RESPONSE_CACHE_SIMILARITY = 0.95
+
+# --- Telemetry: per-stage timings (file loading, retrieval, prompt, model call, memory save, GUI render) are appended here.
+# Summarize with `python Telemetry.py`. None = off.
+TELEMETRY_FILE = 'nhp_telemetry.jsonl'
 
 # --- Debug mode: if True, disables GUI and prints context fed to model ---
 DEBUG_CONTEXT_MODE = False
 
+# --- Streaming: if True, answers appear in the chat window as they are generated ---
+STREAM_RESPONSES = True
+
 # NHP prompt: this is the prompt that specifies what NHP it is supposed to be, for narrative fun. Leave blank to ignore.
 
 NHP_PROMPT = "Your name is Tora, a name you chose yourself. \
@@ -44,23 +101,83 @@ Since you are a sentient entity, while in a conversational state you can generat
 # ====================================
 
 
-def get_model_context_length(model: str) -> int:
-    """Query Ollama for the model's max context length."""
+def ollama_client(**kwargs):
+    """The ollama module, or an ollama.Client(**kwargs). Imported on first use: httpx/pydantic take ~0.3 s to load."""
+    import ollama
+    return ollama.Client(**kwargs) if kwargs else ollama
+
+def get_model_context_length(model: str, client=None):
+    """Query Ollama for the model's max context length (None if it doesn't say)."""
+    info = (client or ollama_client()).show(model)
+    # Some models use 'context_length', others 'parameters' dict; current Ollama reports '<architecture>.context_length' in model_info
+    if 'context_length' in info:
+        return int(info['context_length'])
+    elif 'parameters' in info and isinstance(info['parameters'], dict) and 'context_length' in info['parameters']:
+        return int(info['parameters']['context_length'])
+    for key, value in (info.get('model_info') or {}).items():
+        if key.endswith('.context_length'):
+            return int(value)
+    return None
+
+def model_digest(model: str, client=None):
+    """Digest of the installed model, which changes whenever the model is re-pulled or rebuilt."""
+    name = model if ':' in model else f"{model}:latest"
+    for m in (client or ollama_client()).list().get('models', []):
+        if (m.get('model') or m.get('name')) in (model, name):
+            return m.get('digest')
+    return None
+
+def load_model_info() -> Dict:
     try:
-        info = ollama.show(model)
-        # Some models use 'context_length', others 'parameters' dict
-        if 'context_length' in info:
-            return int(info['context_length'])
-        elif 'parameters' in info and 'context_length' in info['parameters']:
-            return int(info['parameters']['context_length'])
-    except Exception:
-        pass
-    # Fallback to 32768 if not found
-    print("Failed to find model's max context length.")
-    return 32768
-
-MAX_INPUT_TOKENS = get_model_context_length(OLLAMA_MODEL)
+        with open(MODEL_INFO_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def set_max_input_tokens(context_length: int):
+    global MAX_INPUT_TOKENS, TOKEN_WARN_THRESHOLD
+    MAX_INPUT_TOKENS = context_length
+    TOKEN_WARN_THRESHOLD = int(MAX_INPUT_TOKENS * 0.8)
+
+def refresh_model_info(model: str = OLLAMA_MODEL, client=None, save: bool = True) -> int:
+    """
+    Update MAX_INPUT_TOKENS for model. Ollama's `show` is only asked again when the model's digest differs
+    from the one in MODEL_INFO_FILE; if Ollama can't be reached the cached (or default) value stays.
+    With save=False (e.g. for a FakeClient's made-up info) the result is used for this run but not written to MODEL_INFO_FILE.
+    """
+    cache = load_model_info()
+    try:
+        client = client or ollama_client(timeout=MODEL_INFO_TIMEOUT)
+        digest = model_digest(model, client)
+        entry = cache.get(model)
+        if digest is None or entry is None or entry.get('digest') != digest:
+            context_length = get_model_context_length(model, client)
+            if context_length is None:
+                print("Failed to find model's max context length.")
+                return MAX_INPUT_TOKENS
+            cache[model] = {'digest': digest, 'context_length': context_length}
+            if save:
+                tmp_path = MODEL_INFO_FILE + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(cache, f, indent=2)
+                os.replace(tmp_path, MODEL_INFO_FILE)
+        else:
+            context_length = entry['context_length']
+    except Exception as e:
+        print(f"Could not get model info from Ollama ({e}), assuming {MAX_INPUT_TOKENS} tokens of context.")
+        return MAX_INPUT_TOKENS
+    set_max_input_tokens(context_length)
+    return context_length
+
+def start_model_info_refresh(model: str = OLLAMA_MODEL, client=None, save: bool = True) -> threading.Thread:
+    thread = threading.Thread(target=refresh_model_info, args=(model, client, save), daemon=True)
+    thread.start()
+    return thread
+
+# Last known value from MODEL_INFO_FILE; refresh_model_info() updates it once Ollama answers
+MAX_INPUT_TOKENS = load_model_info().get(OLLAMA_MODEL, {}).get('context_length', DEFAULT_CONTEXT_LENGTH)
 TOKEN_WARN_THRESHOLD = int(MAX_INPUT_TOKENS * 0.8)
+TOKEN_COUNTER = TokenCounter(TOKENIZER_FILE)
 
 
 
@@ -82,51 +199,136 @@ def load_txt(file_path: str) -> str:
 
 def build_context(paragraphs: List[Dict]) -> str:
     """Format paragraphs for context to send to LLM."""
-    context = []
-    for p in paragraphs:
-        header = p.get('header', '')
-        page = p.get('page', None)
-        para = p.get('paragraph', '')
-        context.append(f"[Header: {header}] [Page: {page}]\n{para}")
-    return '\n\n'.join(context)
+    with tracer.span('build_context', paragraphs=len(paragraphs)):
+        return '\n\n'.join(format_paragraph(p) for p in paragraphs)
+
+def load_paragraphs(context_files: List[str]) -> ChainedRecords:
+    """
+    Load every context file as {header, page, paragraph} records for the retrieval index.
+    Each file becomes a compact Corpus (cached next to it as <file>.corpus and memory-mapped on later runs);
+    records are only materialized, and formatted, for the paragraphs that are actually sent to the model.
+    """
+    with tracer.span('load.paragraphs', files=len(context_files)) as span:
+        sources = []
+        for context_file in context_files:
+            if not os.path.exists(context_file):
+                raise FileNotFoundError(f"File not found: {context_file}")
+            if context_file.lower().endswith(('.jsonl', '.txt')):
+                sources.append(Corpus.open(context_file))
+            else:
+                raise ValueError(f"Unsupported file type: {context_file}. Please provide a .jsonl or .txt file.")
+        records = ChainedRecords(sources)
+        span['paragraphs'] = len(records)
+    return records
 
 
 def count_tokens(text: str) -> int:
-    # Simple token estimate: 1 token ≈ 4 chars (for English, rough)
-    return len(text) // 4
-
-def ask_ollama(context: str, question: str, memory: list, model: str = 'llama3') -> str:
-    """Send context, memory, and question to Ollama and get a response."""
-    # Compose messages: memory (as chat), then RAG context, then user question
-    messages = []
-    for m in memory:
-        messages.append(m)
-    # Add system prompt with directive, conversation log, and repeated user question
-    # Build conversation log string
-    conversation_log = "\n".join([
-        f"[USER] {m['content']}" if m['role'] == 'user' else f"[NHP] {m['content']}"
-        for m in memory
-    ])
-    directive = (
-        "You are an NHP within the LANCER universe tasked with answering user questions. Utilize the context available to you to answer the user's question to the best of your ability. "
-        "You will be provided a portion of the LANCER core rule book for which to base your answers on."
-        f"{NHP_PROMPT if NHP_PROMPT else ''}"
-        "If you can't answer the question, instead provide a reason as to why. "
-        "If the context is long, prioritize the user's question above all else.\n"
-        "When answering the question, it is very important that you only answer using data from the context. Do not make up new context. If the question can't be answered with the provided context, explain so to the user.\n"
-        "---\n"
-        "IMPORTANT: The following is the reference CONTEXT. It is NOT the user's question. Do not treat the context as a question. Only use it as supporting information.\n"
-        "After the context, you will see the a conversation log and the USER'S QUESTION. Only answer the user's question, using the context as reference.\n"
-        "---\n"
+    """Tokens in text, from the model's tokenizer if TOKENIZER_FILE loaded, else estimated. Cached per text."""
+    return TOKEN_COUNTER.count(text)
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    return TOKEN_COUNTER.count_messages(messages)
+
+def count_prompt_tokens(context: str, question: str, history: list) -> int:
+    """
+    Tokens of build_messages(context, question, history), counted in parts so each part's count stays cached:
+    the directive and context wrapper never change, and the context is summed per paragraph.
+    """
+    return count_message_tokens(build_messages('', question, history)) + count_tokens(context)
+
+# The directive never changes between turns, so it is built once. Keeping it (and the context after it)
+# byte-identical lets Ollama reuse the already evaluated prompt instead of re-reading ~30k tokens each turn.
+DIRECTIVE = (
+    "You are an NHP within the LANCER universe tasked with answering user questions. Utilize the context available to you to answer the user's question to the best of your ability. "
+    "You will be provided a portion of the LANCER core rule book for which to base your answers on."
+    f"{NHP_PROMPT if NHP_PROMPT else ''}"
+    "If you can't answer the question, instead provide a reason as to why. "
+    "If the context is long, prioritize the user's question above all else.\n"
+    "When answering the question, it is very important that you only answer using data from the context. Do not make up new context. If the question can't be answered with the provided context, explain so to the user.\n"
+    "---\n"
+    "IMPORTANT: The next message is the reference CONTEXT. It is NOT the user's question. Do not treat the context as a question. Only use it as supporting information.\n"
+    "After the context, you will see the conversation so far and then the user's question. Only answer the user's question, using the context as reference."
+)
+
+def build_messages(context: str, question: str, history: list) -> List[Dict]:
+    """
+    Assemble the chat messages sent to Ollama for one question, always in the same order:
+    constant directive, context, conversation history, question. Anything that changes per turn comes last,
+    so consecutive turns share the longest possible prompt prefix.
+    """
+    messages = [{"role": "system", "content": DIRECTIVE}]
+    messages.append({"role": "system", "content": (
         f"CONTEXT STARTS:\n{context}\nCONTEXT ENDS\n"
         "---\n"
-        "CONVERSATION LOG (this is the chat history so far, use it to maintain continuity):\n"
-        f"{conversation_log}\n"
-        f"USER QUESTION: {question}\n"
-        "---\n"
         "Again: Do NOT treat the context as a question. Only answer the user's question, using the context as reference."
-        "Please give your response to the user's question:"
-    )
+    )})
+    messages.extend({"role": m['role'], "content": m['content']} for m in history)
+    messages.append({"role": "user", "content": question})
+    return messages
+
+def question_context(context: str, question: str, retriever: RetrievalIndex = None, stat_rows: str = '', context_budget: int = None) -> str:
+    """
+    Everything sent as context with question: the matching stat rows, context, then (with a retrieval index)
+    the paragraphs relevant to the question, compressed to COMPRESSED_CONTEXT_TOKENS if that is set.
+    """
+    context = '\n\n---\n\n'.join(c for c in (stat_rows, context) if c)
+    if retriever is None:
+        return context
+    with tracer.span('retrieval'):
+        if COMPRESSED_CONTEXT_TOKENS:
+            records = retriever.select(question, context_budget or CONTEXT_TOKEN_BUDGET, count_tokens)
+        else:
+            retrieved = retriever.context_for(question, context_budget or CONTEXT_TOKEN_BUDGET, count_tokens)
+    if COMPRESSED_CONTEXT_TOKENS:
+        with tracer.span('compress', paragraphs=len(records)) as span:
+            retrieved = compress(records, question, COMPRESSED_CONTEXT_TOKENS, count_tokens, retriever.idf)
+            span['chars'] = len(retrieved)
+    return '\n\n---\n\n'.join(c for c in (context, retrieved) if c)
+
+def ask_ollama(context: str, question: str, memory: list, model: str = 'llama3', retriever: RetrievalIndex = None, stream: bool = False, client=None, stat_store: StatStore = None, response_cache: ResponseCache = None, context_budget: int = None) -> str:
+    """
+    Send context, memory, and question to Ollama and get a response.
+    Returns (answer, token_msg); with stream=True the answer is an iterator of text chunks instead.
+    client defaults to the ollama module, but anything with the same chat() works (see FakeOllama.py).
+    With a response_cache, standalone questions that were already answered from the same context skip the model.
+    context_budget overrides CONTEXT_TOKEN_BUDGET for the retrieved context.
+    """
+    client = client or ollama_client()
+    # Stat questions are answered from the statblock tables, or get just the matching rows as context
+    stat_query = stat_store.match(question) if stat_store is not None and STAT_ANSWER_MODE else None
+    if stat_query is not None:
+        if STAT_ANSWER_MODE == 'direct' and stat_query.categories:
+            answer = stat_store.answer(stat_query)
+            tracer.count('stat_table.answer')
+            token_msg = "[Answered from the stat tables, no model call]"
+            return (iter([answer]) if stream else answer), token_msg
+    stat_rows = stat_store.row_context(stat_query) if stat_query is not None else ''
+    context = question_context(context, question, retriever, stat_rows, context_budget)
+    # Conversation turns depend on the history, so only standalone questions go through the cache
+    cache_key = (question, context, model) if response_cache is not None and is_cacheable(question) else None
+    if cache_key is not None:
+        cached = response_cache.get(*cache_key)
+        if cached is not None:
+            tracer.count('response_cache.hit')
+            answer, token_msg = cached
+            token_msg = "[Cached response, no model call]\n" + token_msg
+            return (iter([answer]) if stream else answer), token_msg
+    with tracer.span('prompt') as span:
+        # ConversationMemory already limits history to the summary + recent turns; plain lists are sent as-is
+        history = memory.prompt_history() if hasattr(memory, 'prompt_history') else list(memory)
+        messages = build_messages(context, question, history)
+        input_tokens = count_prompt_tokens(context, question, history)
+        dropped = 0
+        if input_tokens >= MAX_INPUT_TOKENS and history:
+            # Over the limit: drop the oldest history until it fits
+            excess = input_tokens - MAX_INPUT_TOKENS + 1
+            while history and excess > 0:
+                m = history.pop(0)
+                excess -= count_tokens(m['content']) + MESSAGE_OVERHEAD
+                dropped += 1
+            messages = build_messages(context, question, history)
+            input_tokens = count_prompt_tokens(context, question, history)
+        span.update(input_tokens=input_tokens, history=len(history))
     # === Suggestions for higher-impact/complexity improvements ===
     #
     # 1. Implement context chunking/sliding window: If the combined context exceeds the model's token limit, automatically select the most relevant chunks based on the user's question (using keyword matching, embeddings, or a vector database).
@@ -139,66 +341,176 @@ def ask_ollama(context: str, question: str, memory: list, model: str = 'llama3')
     # 8. Add logging, analytics, and error reporting for monitoring usage and debugging.
     # 9. Allow context files to be specified via command-line arguments or a config file for more flexible deployment.
     # 10. Add automated tests and CI/CD integration for robust development.
-    messages.append({"role": "system", "content": directive})
-    messages.append({"role": "user", "content": question})
-    total_input = '\n'.join([m['content'] for m in messages])
-    input_tokens = count_tokens(total_input)
     token_msg = f"[Token usage: {input_tokens} / {MAX_INPUT_TOKENS} tokens]"
+    if dropped:
+        token_msg += f"\n[Dropped the {dropped} oldest memory messages to fit the model's context]"
     if input_tokens >= MAX_INPUT_TOKENS:
         token_msg += "\n[WARNING: Input exceeds model max tokens! Response may be truncated or fail.]"
     elif input_tokens >= TOKEN_WARN_THRESHOLD:
         token_msg += f"\n[Warning: Approaching model max tokens ({TOKEN_WARN_THRESHOLD})]"
-    messages.append({"role": "system", "content": token_msg})
-    response = ollama.chat(model=model, messages=messages)
-    return response['message']['content'], token_msg # type: ignore
+    # The token message is only shown to the user; sending it would put a changing message after the question
+    options = {'num_ctx': MAX_INPUT_TOKENS, **OLLAMA_OPTIONS}
+    if stream:
+        start = time.perf_counter()
+        parts = client.chat(model=model, messages=messages, stream=True, options=options, keep_alive=OLLAMA_KEEP_ALIVE)
+        chunks = _traced_stream(parts, model, start)
+        if cache_key is not None:
+            chunks = _cache_stream(chunks, response_cache, cache_key, token_msg)
+        return chunks, token_msg
+    with tracer.span('ollama.chat', model=model, stream=False) as span:
+        response = client.chat(model=model, messages=messages, options=options, keep_alive=OLLAMA_KEEP_ALIVE)
+        span.update(server_timing(response))
+    answer = response['message']['content']
+    if cache_key is not None:
+        response_cache.put(*cache_key, answer, token_msg)
+    return answer, token_msg # type: ignore
+
+def _traced_stream(parts, model: str, start: float):
+    # The final streamed part carries Ollama's timing fields; the call is logged once the stream is used up
+    first_token_ms = None
+    last = None
+    for part in parts:
+        if first_token_ms is None:
+            first_token_ms = round((time.perf_counter() - start) * 1000, 3)
+        last = part
+        yield part['message']['content']
+    tracer.record('ollama.chat', (time.perf_counter() - start) * 1000, model=model, stream=True,
+                  first_token_ms=first_token_ms, **(server_timing(last) if last is not None else {}))
+
+def _cache_stream(chunks, response_cache: ResponseCache, cache_key, token_msg):
+    # Pass the stream through, caching the answer once it has been received in full
+    pieces = []
+    for chunk in chunks:
+        pieces.append(chunk)
+        yield chunk
+    response_cache.put(*cache_key, ''.join(pieces), token_msg)
 
 
 
 # --- Memory functions for GUI ---
-def load_memory():
-    if os.path.exists(MEMORY_FILE):
-        try:
-            with open(MEMORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return []
-    return []
+SUMMARY_PROMPT = (
+    "You maintain the long-term memory of an NHP talking with its pilot. "
+    "Update the current summary with the new part of the conversation. Keep names, decisions, promises, "
+    "the pilot's preferences and anything the NHP said about itself. Drop small talk. "
+    "Output ONLY the updated summary, in a few short paragraphs."
+)
+
+def summarize_history(summary: str, messages: List[Dict], client=None) -> str:
+    """Fold older messages into the running memory summary (runs on ConversationMemory's background thread)."""
+    transcript = "\n".join(
+        f"[USER] {m['content']}" if m['role'] == 'user' else f"[NHP] {m['content']}"
+        for m in messages
+    )
+    prompt = f"{SUMMARY_PROMPT}\n\nCURRENT SUMMARY:\n{summary or '(none yet)'}\n\nNEW CONVERSATION:\n{transcript}\n\nUPDATED SUMMARY:"
+    with tracer.span('memory.summarize', model=OLLAMA_MODEL, messages=len(messages)) as span:
+        response = (client or ollama_client()).chat(model=OLLAMA_MODEL, messages=[{"role": "user", "content": prompt}], keep_alive=OLLAMA_KEEP_ALIVE)
+        span.update(server_timing(response))
+    return response['message']['content'].strip()
+
+def load_memory(path: str = MEMORY_FILE, client=None) -> ConversationMemory:
+    legacy_path = LEGACY_MEMORY_FILE if path == MEMORY_FILE else None
+    summarize = partial(summarize_history, client=client) if client is not None else summarize_history
+    return ConversationMemory(path, summarize=summarize, keep_turns=MEMORY_KEEP_TURNS,
+                              token_budget=HISTORY_TOKEN_BUDGET, count_tokens=count_tokens, legacy_path=legacy_path)
 
 def save_memory(memory):
-    with open(MEMORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(memory, f, ensure_ascii=False, indent=2)
-
+    # Only the new messages are appended to the log; compaction of old turns happens in the background
+    with tracer.span('memory.save'):
+        memory.flush()
+        memory.maybe_compact()
 
-if __name__ == '__main__':
 
-    def get_context_from_files(context_files):
+# --- Startup: load the corpus and the optional indexes (shared by the GUI and Server.py) ---
+# These raise FileNotFoundError/ValueError for missing or unsupported files; progress gets status lines.
+def get_context_from_files(context_files):
+    with tracer.span('load.context_files', files=len(context_files)):
         contexts = []
         for context_file in context_files:
             if not os.path.exists(context_file):
-                print(f"File not found: {context_file}")
-                exit(1)
+                raise FileNotFoundError(f"File not found: {context_file}")
             if context_file.lower().endswith('.jsonl'):
-                data = load_jsonl(context_file)
-                contexts.append(build_context(data))
+                # Formatted straight from the compact store, without a list of dicts in between
+                contexts.append(build_context(Corpus.open(context_file)))
             elif context_file.lower().endswith('.txt'):
                 contexts.append(load_txt(context_file))
             else:
-                print(f"Unsupported file type: {context_file}. Please provide a .jsonl or .txt file.")
-                exit(1)
+                raise ValueError(f"Unsupported file type: {context_file}. Please provide a .jsonl or .txt file.")
         return '\n\n---\n\n'.join(contexts)
 
+def get_retriever(context_files, progress=print):
+    progress(f"Indexing {len(context_files)} context files...")
+    paragraphs = load_paragraphs(context_files)
+    progress(f"Indexed {len(paragraphs)} paragraphs for retrieval.")
+    vector_store = None
+    if USE_EMBEDDINGS:
+        # Imported here so numpy/sentence-transformers are only needed when embeddings are on
+        from VectorStore import VectorStore
+        progress("Updating paragraph embeddings...")
+        vector_store = VectorStore(EMBEDDING_STORE_DIR, EMBEDDING_MODEL)
+        encoded = vector_store.sync(paragraphs)
+        progress(f"Embedded {encoded} new or changed paragraphs.")
+    if not RETRIEVAL_INDEX_FILE:
+        return RetrievalIndex(paragraphs, vector_store, RETRIEVAL_RANKING)
+    # The saved index is only valid for exactly these files, unchanged since it was written
+    key = []
+    for context_file in context_files:
+        stat = os.stat(context_file)
+        key.append([os.path.abspath(context_file), stat.st_size, stat.st_mtime_ns])
+    return RetrievalIndex.open(paragraphs, RETRIEVAL_INDEX_FILE, key, vector_store, RETRIEVAL_RANKING)
+
+def get_response_cache(retriever):
+    # Near-duplicate matching reuses the paragraph embedding model
+    vector_store = getattr(retriever, 'vector_store', None)
+    embed = vector_store.embed if vector_store is not None and RESPONSE_CACHE_SIMILARITY else None
+    return ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, embed=embed, similarity=RESPONSE_CACHE_SIMILARITY or 1.0)
+
+def get_stat_store(stat_files, progress=print):
+    stat_store = StatStore()
+    for stat_file in stat_files:
+        if os.path.exists(stat_file):
+            stat_store.load(stat_file)
+    progress(f"Loaded {len(stat_store)} statblocks.")
+    return stat_store
+
+def load_corpus(progress=print) -> Dict:
+    """Everything ask_ollama needs besides memory: the bound ask function and the fixed context (empty in retrieval mode)."""
+    retriever = get_retriever(CONTEXT_FILES, progress) if RETRIEVAL_MODE else None
+    stat_store = get_stat_store(STAT_FILES, progress) if STAT_ANSWER_MODE else None
+    response_cache = get_response_cache(retriever) if RESPONSE_CACHE else None
+    if retriever is None:
+        progress(f"Reading {len(CONTEXT_FILES)} context files...")
+    # In retrieval mode the context is picked per question inside ask_ollama
+    rag_context = '' if retriever is not None else get_context_from_files(CONTEXT_FILES)
+    return {
+        'ask_ollama': partial(ask_ollama, retriever=retriever, stat_store=stat_store, response_cache=response_cache),
+        'retriever': retriever,
+        'stat_store': stat_store,
+        'rag_context': rag_context,
+    }
+
+
+if __name__ == '__main__':
+
+    tracer.configure(TELEMETRY_FILE)
     if DEBUG_CONTEXT_MODE:
-        rag_context = get_context_from_files(CONTEXT_FILES)
+        refresh_model_info(OLLAMA_MODEL)
+        try:
+            corpus = load_corpus()
+        except (FileNotFoundError, ValueError) as e:
+            print(e)
+            exit(1)
+        stat_store = corpus['stat_store']
         memory = load_memory()
         user_input = input("Enter a sample user prompt to debug context: ")
-        # Compose messages as in ask_ollama
-        messages = []
-        for m in memory:
-            messages.append(m)
-        messages.append({"role": "system", "content": f"Reference context for this session:\n{rag_context}"})
-        messages.append({"role": "user", "content": user_input})
-        total_input = '\n'.join([m['content'] for m in messages])
-        input_tokens = count_tokens(total_input)
+        stat_query = stat_store.match(user_input) if stat_store is not None else None
+        if stat_query is not None and STAT_ANSWER_MODE == 'direct' and stat_query.categories:
+            print("This question is answered from the stat tables without a model call; writing the prompt it would get otherwise.")
+        stat_rows = stat_store.row_context(stat_query) if stat_query is not None else ''
+        # Compose the context and messages as in ask_ollama
+        rag_context = question_context(corpus['rag_context'], user_input, corpus['retriever'], stat_rows)
+        history = memory.prompt_history()
+        messages = build_messages(rag_context, user_input, history)
+        input_tokens = count_prompt_tokens(rag_context, user_input, history)
         token_msg = f"[Token usage: {input_tokens} / {MAX_INPUT_TOKENS} tokens]"
         if input_tokens >= MAX_INPUT_TOKENS:
             token_msg += "\n[WARNING: Input exceeds model max tokens! Response may be truncated or fail.]"
@@ -211,8 +523,19 @@ if __name__ == '__main__':
                 f.write(f"[{m['role'].upper()}] {str(m['content'])}\n\n")
             f.write(token_msg + "\n")
     else:
-        rag_context = get_context_from_files(CONTEXT_FILES)
-        # Pass all required functions and variables to start_gui, including rag_context
+        from Window import start_gui
+        # The window opens right away; model info and the corpus are loaded behind it
+        model_info = start_model_info_refresh(OLLAMA_MODEL)
+
+        def startup(progress):
+            corpus = load_corpus(progress)
+            if model_info.is_alive():
+                progress("Waiting for model info from Ollama...")
+            model_info.join()
+            corpus.update(MAX_INPUT_TOKENS=MAX_INPUT_TOKENS, TOKEN_WARN_THRESHOLD=TOKEN_WARN_THRESHOLD)
+            return corpus
+
+        # Pass all required functions and variables to start_gui; startup() replaces ask_ollama and rag_context once it finishes
         start_gui(
             JSONL_FILE=CONTEXT_FILES,
             CONTEXT_FILE=MEMORY_FILE,
@@ -225,5 +548,7 @@ if __name__ == '__main__':
             save_memory=save_memory,
             ask_ollama=ask_ollama,
             count_tokens=count_tokens,
-            rag_context=rag_context
+            rag_context='',
+            STREAM_RESPONSES=STREAM_RESPONSES,
+            startup=startup
         )
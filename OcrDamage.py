@@ -0,0 +1,156 @@
+import argparse
+import difflib
+import os
+import re
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from Glyphs import GlyphMap
+from TextChunker import TABLE_LINE_PATTERN
+
+
+# === USER CONFIGURABLE PARAMETERS ===
+# Word list (one word per line) whose words are never counted as OCR damage, e.g. '/usr/share/dict/words'. None = none.
+DICTIONARY_FILE = None
+# Words used at least this often in the document count as known too, so rules terms and names don't need a word list
+DOCUMENT_WORD_MIN_COUNT = 3
+DAMAGE_THRESHOLD = 1.0      # Chunks scoring at least this are sent to the model by TextCleaner
+SCORE_WORKERS = os.cpu_count()
+PARALLEL_MIN_CHUNKS = 64    # Fewer chunks than this are scored in-process (starting workers costs more)
+# ====================================
+
+# Each signal adds (amount * weight) to a chunk's score; the weights are set so 1.0 means "worth a model call".
+SIGNAL_WEIGHTS = {
+    'unknown_glyphs': 1.0,      # Private-use characters that aren't in GlyphMap (an icon the extractor can't name)
+    'bad_characters': 1.0,      # U+FFFD replacement characters and stray control characters
+    'ligatures': 0.5,           # Unexpanded "ﬁ", "ﬂ", ... that break searches for the word
+    'broken_hyphens': 0.5,      # "move-\nment", "move- ment"
+    'split_words': 1.0,         # "L O C K  O N": a word printed one letter at a time
+    'mangled_tokens': 0.25,     # Words like "l0ck" or "tHe"
+    'unknown_words': 0.15,      # Words that are neither in the dictionary nor common in the document, beyond the allowance
+}
+UNKNOWN_WORD_ALLOWANCE = 0.02  # Names and rare words are normal: this share of a chunk's words may be unknown for free
+
+Damage = namedtuple('Damage', ['score', 'signals'])
+
+WORD_PATTERN = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+TOKEN_PATTERN = re.compile(r"\S+")
+PRIVATE_USE_PATTERN = re.compile('[\ue000-\uf8ff\U000f0000-\U0010ffff]')
+BAD_CHARACTER_PATTERN = re.compile('[\ufffd\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+LIGATURE_PATTERN = re.compile('[\ufb00-\ufb06]')
+BROKEN_HYPHEN_PATTERN = re.compile(r"[a-z]{2,}-(?:\n\s*| )[a-z]{2,}")
+SPLIT_WORD_PATTERN = re.compile(r"\b(?:[A-Za-z] ){3,}[A-Za-z]\b")
+# A digit between letters or a capital between lowercase letters inside one word ("l0ck", "tHe"); dice like "1d6" are fine
+MANGLED_TOKEN_PATTERN = re.compile(r"[A-Za-z][0-9][A-Za-z]|[a-ce-z][A-Z][a-z]|[0-9][a-ce-z][0-9]")
+
+
+def words(text: str) -> List[str]:
+    return [w.lower() for w in WORD_PATTERN.findall(text)]
+
+
+def load_dictionary(path: str = DICTIONARY_FILE) -> set:
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return {line.strip().lower() for line in f if line.strip()}
+
+
+def document_vocabulary(chunks: Iterable[str], dictionary: set = frozenset(), min_count: int = DOCUMENT_WORD_MIN_COUNT) -> frozenset:
+    """Known words: the dictionary plus every word the document itself uses at least min_count times."""
+    counts = Counter()
+    for chunk in chunks:
+        counts.update(words(chunk))
+    return frozenset(dictionary) | frozenset(w for w, n in counts.items() if n >= min_count)
+
+
+def damage_score(text: str, vocabulary: frozenset) -> Damage:
+    """Score one chunk for OCR damage. signals holds the raw amount of every signal that fired."""
+    # Table borders and cells are all punctuation; only the prose lines are checked for mangled words
+    prose = '\n'.join(line for line in text.split('\n') if not TABLE_LINE_PATTERN.match(line))
+    signals = {
+        'unknown_glyphs': sum(1 for ch in PRIVATE_USE_PATTERN.findall(text) if ch not in GlyphMap),
+        'bad_characters': len(BAD_CHARACTER_PATTERN.findall(text)),
+        'ligatures': len(LIGATURE_PATTERN.findall(text)),
+        'broken_hyphens': len(BROKEN_HYPHEN_PATTERN.findall(prose)),
+        'split_words': len(SPLIT_WORD_PATTERN.findall(prose)),
+    }
+    signals['mangled_tokens'] = sum(1 for t in TOKEN_PATTERN.findall(prose) if MANGLED_TOKEN_PATTERN.search(t))
+    prose_words = [w for w in words(prose) if len(w) > 2]
+    unknown = sum(1 for w in prose_words if w not in vocabulary)
+    signals['unknown_words'] = max(unknown - int(UNKNOWN_WORD_ALLOWANCE * len(prose_words)), 0)
+    signals = {name: amount for name, amount in signals.items() if amount}
+    return Damage(sum(amount * SIGNAL_WEIGHTS[name] for name, amount in signals.items()), signals)
+
+
+_worker_vocabulary = frozenset()
+
+def _init_worker(vocabulary):
+    global _worker_vocabulary
+    _worker_vocabulary = vocabulary
+
+def _score_in_worker(text):
+    return damage_score(text, _worker_vocabulary)
+
+
+def score_chunks(chunks: List[str], dictionary_file: str = DICTIONARY_FILE, workers: int = SCORE_WORKERS) -> List[Damage]:
+    """Damage of every chunk, in order. Large documents are scored in a process pool, one chunk (page) per task."""
+    vocabulary = document_vocabulary(chunks, load_dictionary(dictionary_file))
+    if len(chunks) < PARALLEL_MIN_CHUNKS or workers == 1:
+        return [damage_score(chunk, vocabulary) for chunk in chunks]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(vocabulary,)) as pool:
+        return list(pool.map(_score_in_worker, chunks, chunksize=max(len(chunks) // (4 * workers), 1)))
+
+
+def iter_damage(chunks: Iterable[str], vocabulary: frozenset, workers: int = SCORE_WORKERS) -> Iterator[Tuple[str, Damage]]:
+    """
+    (chunk, damage) for every chunk, in order, reading chunks only as far as needed: a streamed file is scored as it
+    is read. Large documents are scored in a process pool, one chunk (page) per task, up to 4 tasks per worker ahead.
+    """
+    chunks = iter(chunks)
+    head = list(islice(chunks, PARALLEL_MIN_CHUNKS))
+    if len(head) < PARALLEL_MIN_CHUNKS or workers == 1:
+        for chunk in chain(head, chunks):
+            yield chunk, damage_score(chunk, vocabulary)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(vocabulary,)) as pool:
+        pending = deque()
+        for chunk in chain(head, chunks):
+            pending.append((chunk, pool.submit(_score_in_worker, chunk)))
+            if len(pending) >= 4 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+
+def drift(original: str, cleaned: str) -> float:
+    """Share of the words that differ between original and cleaned (0.0 = same words, 1.0 = nothing in common)."""
+    a, b = original.split(), cleaned.split()
+    if not a and not b:
+        return 0.0
+    return 1.0 - difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score the chunks of a text file for OCR damage, the way TextCleaner's pre-filter does.")
+    parser.add_argument('txt_file')
+    parser.add_argument('--paragraphs', action='store_true', help="Chunk by paragraph instead of by page")
+    parser.add_argument('--threshold', type=float, default=DAMAGE_THRESHOLD)
+    parser.add_argument('--show', type=int, default=10, help="Print this many of the most damaged chunks")
+    args = parser.parse_args()
+
+    from TextCleaner import CHUNK_SIZE, iter_chunks
+    with open(args.txt_file, 'r', encoding='utf-8') as f:
+        chunks = list(iter_chunks(f, chunk_size=CHUNK_SIZE, by_page=not args.paragraphs))
+    damages = score_chunks([chunk.text for chunk in chunks])
+    flagged = [i for i, d in enumerate(damages) if d.score >= args.threshold]
+    print(f"{len(flagged)}/{len(chunks)} chunks score {args.threshold} or more and would be sent to the model.")
+    signal_totals: Dict[str, int] = Counter(name for d in damages for name in d.signals)
+    for name, count in signal_totals.most_common():
+        print(f"  {name}: {count} chunks")
+    for i in sorted(flagged, key=lambda i: -damages[i].score)[:args.show]:
+        signals = ', '.join(f"{name}={amount}" for name, amount in damages[i].signals.items())
+        print(f"\n[chunk {i + 1}, page {chunks[i].page}] score {damages[i].score:.2f}: {signals}\n{chunks[i].text[:300]}")
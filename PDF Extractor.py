@@ -1,37 +1,59 @@
-import fitz
-import requests
-import numpy as np
-import faiss
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import pymupdf
 import pymupdf.layout
 import pymupdf4llm
-from sentence_transformers import SentenceTransformer
-import pathlib
 
-GlyphMap = {
-    # Damage Types
-    "": "Kinetic",
-    "": "Explosive",
-    "": "Energy",
-    "": "Burn",
-    "": "Heat",
-    # Ranges
-    "": "Range",
-    "": "Threat",
-    # Area Shapes
-    "": "Blast",
-    "": "Burst",
-    "": "Line",
-    "": "Cone",
-    # Accuracy/Difficulty
-    "": "Accuracy",
-    "": "Difficulty"
-}
-
-
-plain_text = pymupdf4llm.to_text("CoreBookSnippet 379-382 (NHPs).pdf")
-
-for glyph, replacement in GlyphMap.items():
-    plain_text = plain_text.replace(glyph, replacement) # type: ignore
-
-pathlib.Path("Output NHP.txt").write_bytes(plain_text.encode()) # type: ignore
+from Glyphs import GlyphTable
+
+
+# === USER CONFIGURABLE PARAMETERS ===
+PDF_FILE = "CoreBookSnippet 379-382 (NHPs).pdf"
+OUTPUT_FILE = "Output NHP.txt"
+PAGES_PER_SHARD = 16           # Pages extracted per worker task
+EXTRACT_WORKERS = os.cpu_count()
+SERIAL_MODE = False            # If True, extract the whole PDF in one process like before
+VERIFY_SERIAL = False          # If True, also run the serial path and check both outputs are identical (test_pdf_extractor.py does this on a generated sample)
+# ====================================
+
+
+def extract_pages(pdf_path, start, stop):
+    """Extract pages [start, stop) as text with glyphs translated. Runs in a worker process."""
+    text = pymupdf4llm.to_text(pdf_path, pages=list(range(start, stop)))
+    return start, text.translate(GlyphTable) # type: ignore
+
+
+def extract_serial(pdf_path, output_path):
+    plain_text = pymupdf4llm.to_text(pdf_path)
+    plain_text = plain_text.translate(GlyphTable) # type: ignore
+    pathlib.Path(output_path).write_bytes(plain_text.encode()) # type: ignore
+
+
+def extract_parallel(pdf_path, output_path, pages_per_shard=PAGES_PER_SHARD, workers=EXTRACT_WORKERS):
+    """
+    Split the PDF into page ranges, extract them in a process pool, and write each range to
+    output_path as soon as it is next in page order, so the whole book is never held in memory.
+    """
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+    starts = list(range(0, page_count, pages_per_shard))
+    stops = [min(start + pages_per_shard, page_count) for start in starts]
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(output_path, 'wb') as out:
+        # map() hands results back in submission order, i.e. page order, while later shards keep running
+        for start, text in pool.map(extract_pages, repeat(pdf_path), starts, stops):
+            out.write(text.encode())
+            print(f"Extracted pages {start + 1}-{min(start + pages_per_shard, page_count)} of {page_count}")
+
 
+if __name__ == '__main__':
+    if SERIAL_MODE:
+        extract_serial(PDF_FILE, OUTPUT_FILE)
+    else:
+        extract_parallel(PDF_FILE, OUTPUT_FILE)
+    if VERIFY_SERIAL and not SERIAL_MODE:
+        serial_file = OUTPUT_FILE + '.serial'
+        extract_serial(PDF_FILE, serial_file)
+        same = pathlib.Path(serial_file).read_bytes() == pathlib.Path(OUTPUT_FILE).read_bytes()
+        print("Parallel output matches the serial path." if same else f"MISMATCH: compare {OUTPUT_FILE} with {serial_file}")
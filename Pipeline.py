@@ -0,0 +1,252 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import TextChunker
+import TextCleaner
+from CleanCache import CleanCache
+from Corpus import Corpus
+from Telemetry import tracer
+
+
+# === USER CONFIGURABLE PARAMETERS ===
+# Documents to ingest when none are given on the command line. PDFs start at extract, .txt files at clean.
+PIPELINE_DOCUMENTS = ['CoreBookSnippet 379-382 (NHPs).pdf']
+PIPELINE_DIR = 'pipeline'       # Where every stage writes its output (<name>.extracted.txt, <name>.cleaned.txt, <name>.jsonl)
+DOCUMENT_WORKERS = 2            # Documents processed at the same time
+# Cleaning settings (model, prompt, chunking, cache) come from the TextCleaner.py config block
+# ====================================
+
+STAGES = ['extract', 'clean', 'chunk', 'index']
+# Source files whose code decides each stage's output; editing one re-runs that stage (and everything after it)
+STAGE_CODE = {
+    'extract': ['PDF Extractor.py', 'Glyphs.py'],
+    'clean': ['TextCleaner.py', 'OcrDamage.py', 'Glyphs.py', 'TextChunker.py'],
+    'chunk': ['TextChunker.py'],
+    'index': ['Corpus.py', 'TextChunker.py'],
+    'embed': ['VectorStore.py'],
+}
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class PipelineState:
+    """
+    Fingerprints of every stage output the pipeline has produced, kept in <PIPELINE_DIR>/pipeline_state.json.
+    A stage's fingerprint covers its name, the content of its inputs, its parameters and its code; an output whose
+    recorded fingerprint still matches is up to date. File hashes are remembered by (size, mtime) so unchanged
+    files aren't re-read on every run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault('files', {})
+        self.data.setdefault('outputs', {})
+
+    def file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            known = self.data['files'].get(path)
+        if known and known[:2] == stamp:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        with self.lock:
+            self.data['files'][path] = stamp + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def fingerprint(self, stage: str, inputs, params) -> str:
+        parts = {
+            'stage': stage,
+            'inputs': [self.file_hash(p) for p in inputs],
+            'params': params,
+            'code': [self.file_hash(os.path.join(HERE, p)) for p in STAGE_CODE[stage]],
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_fresh(self, output: str, fingerprint: str) -> bool:
+        with self.lock:
+            return os.path.exists(output) and self.data['outputs'].get(output) == fingerprint
+
+    def record(self, output: str, fingerprint: str):
+        with self.lock:
+            self.data['outputs'][output] = fingerprint
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class Pipeline:
+    """Runs extract -> clean -> chunk -> index for each document, skipping stages whose output is still valid."""
+
+    def __init__(self, out_dir=PIPELINE_DIR, until='index', force=(), dry_run=False, embed=False):
+        self.out_dir = out_dir
+        self.last_stage = STAGES.index(until)
+        self.force = set(force)
+        self.dry_run = dry_run
+        self.embed = embed
+        os.makedirs(out_dir, exist_ok=True)
+        self.state = PipelineState(os.path.join(out_dir, 'pipeline_state.json'))
+        self.clean_cache = None
+        self.cache_lock = threading.Lock()
+
+    def run_stage(self, name, stage, inputs, output, params, build, stale_upstream=False, atomic=True):
+        """
+        Run build(target, fingerprint) unless output is up to date. build writes target, which is a temporary
+        file moved over output when it succeeds (or output itself for stages that write in place).
+        Returns True if the stage ran (or would run, in a dry run).
+        """
+        if self.dry_run and stale_upstream:
+            print(f"[{name}] {stage}: would run (input changes)")
+            return True
+        fingerprint = self.state.fingerprint(stage, inputs, params)
+        if stage not in self.force and self.state.is_fresh(output, fingerprint):
+            print(f"[{name}] {stage}: up to date ({output})")
+            return False
+        if self.dry_run:
+            print(f"[{name}] {stage}: would run")
+            return True
+        print(f"[{name}] {stage}: running -> {output}")
+        target = output + '.tmp' if atomic else output
+        with tracer.span(f"pipeline.{stage}", document=name):
+            build(target, fingerprint)
+        if atomic:
+            os.replace(target, output)
+        self.state.record(output, fingerprint)
+        return True
+
+    # --- Stages ---
+    def extract(self, pdf_path, target, fingerprint):
+        # The module name has a space, so it can't be a plain import; import_module registers it in sys.modules,
+        # which the extractor's worker processes need to unpickle extract_pages
+        extractor = importlib.import_module('PDF Extractor')
+        extractor.extract_parallel(pdf_path, target)
+
+    def clean(self, txt_path, output, target, fingerprint):
+        with self.cache_lock:
+            if self.clean_cache is None and TextCleaner.CACHE_FILE:
+                self.clean_cache = CleanCache(TextCleaner.CACHE_FILE, max_bytes=TextCleaner.CACHE_MAX_MB * 1024 * 1024)
+        # The journal is tied to this fingerprint, so a resumed run never mixes in chunks cleaned with other settings
+        journal_path = f"{output}.{fingerprint[:12]}.journal.jsonl"
+        failed = []
+        cleaned = TextCleaner.iter_cleaned_file(
+            txt_path, TextCleaner.OLLAMA_MODEL, TextCleaner.CLEAN_PROMPT, TextCleaner.CHUNK_SIZE, TextCleaner.CHUNK_BY_PAGE,
+            workers=TextCleaner.PIPELINE_WORKERS, journal_path=journal_path, options=TextCleaner.OLLAMA_OPTIONS,
+            cache=self.clean_cache, failed=failed, ocr_threshold=TextCleaner.OCR_DAMAGE_THRESHOLD, max_drift=TextCleaner.MAX_CLEAN_DRIFT
+        )
+        with open(target, 'w', encoding='utf-8') as out:
+            for i, chunk in enumerate(cleaned):
+                out.write(('\n\n' if i else '') + chunk)
+        if failed:
+            raise RuntimeError(f"{len(failed)} chunks could not be cleaned; run the pipeline again to retry them")
+        os.remove(journal_path)
+
+    def chunk(self, cleaned_path, target, fingerprint):
+        TextChunker.parse_output_txt(cleaned_path, target)
+
+    def index(self, jsonl_path, target, fingerprint):
+        # Corpus writes its own <file>.corpus cache, which NHP memory-maps at startup
+        Corpus.open(jsonl_path).close()
+
+    # --- Running ---
+    def run_document(self, path):
+        """Run every stage for one document; returns the JSONL it produced (None if stopped earlier)."""
+        name = os.path.splitext(os.path.basename(path))[0]
+        stem = os.path.join(self.out_dir, name)
+        ran = False
+        if path.lower().endswith('.pdf'):
+            text_path = f"{stem}.extracted.txt"
+            ran = self.run_stage(name, 'extract', [path], text_path, {}, lambda target, fp: self.extract(path, target, fp))
+        elif path.lower().endswith('.txt'):
+            text_path = path
+        else:
+            raise ValueError(f"Unsupported file type: {path}. Please provide a .pdf or .txt file.")
+        if self.last_stage < STAGES.index('clean'):
+            return None
+        cleaned_path = f"{stem}.cleaned.txt"
+        clean_params = {
+            'model': TextCleaner.OLLAMA_MODEL, 'prompt': TextCleaner.CLEAN_PROMPT, 'options': TextCleaner.OLLAMA_OPTIONS,
+            'chunk_size': TextCleaner.CHUNK_SIZE, 'by_page': TextCleaner.CHUNK_BY_PAGE,
+            'ocr_threshold': TextCleaner.OCR_DAMAGE_THRESHOLD, 'max_drift': TextCleaner.MAX_CLEAN_DRIFT,
+        }
+        ran = self.run_stage(name, 'clean', [text_path], cleaned_path, clean_params,
+                             lambda target, fp: self.clean(text_path, cleaned_path, target, fp), ran) or ran
+        if self.last_stage < STAGES.index('chunk'):
+            return None
+        jsonl_path = f"{stem}.jsonl"
+        ran = self.run_stage(name, 'chunk', [cleaned_path], jsonl_path, {}, lambda target, fp: self.chunk(cleaned_path, target, fp), ran) or ran
+        if self.last_stage < STAGES.index('index'):
+            return None
+        self.run_stage(name, 'index', [jsonl_path], jsonl_path + '.corpus', {},
+                       lambda target, fp: self.index(jsonl_path, target, fp), ran, atomic=False)
+        return jsonl_path
+
+    def run(self, documents, workers=DOCUMENT_WORKERS):
+        """Process documents in parallel; returns (JSONL files in document order, failures)."""
+        results, failures = {}, {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {doc: pool.submit(self.run_document, doc) for doc in documents}
+            for doc, future in futures.items():
+                try:
+                    results[doc] = future.result()
+                except Exception as e:
+                    failures[doc] = e
+                    print(f"[{os.path.basename(doc)}] FAILED: {e}")
+        jsonl_files = [results[doc] for doc in documents if results.get(doc)]
+        if self.embed and jsonl_files and not failures and not self.dry_run:
+            self.embed_corpus(jsonl_files)
+        if self.clean_cache is not None:
+            self.clean_cache.close()
+        return jsonl_files, failures
+
+    def embed_corpus(self, jsonl_files):
+        # Embeddings cover the whole corpus at once: VectorStore drops rows that aren't in the paragraphs it is synced with
+        import NHP
+        from VectorStore import VectorStore
+        store = VectorStore(NHP.EMBEDDING_STORE_DIR, NHP.EMBEDDING_MODEL)
+        def build(target, fingerprint):
+            print(f"Embedded {store.sync(NHP.load_paragraphs(jsonl_files))} new or changed paragraphs.")
+        self.run_stage('corpus', 'embed', jsonl_files, store.meta_path, {'model': NHP.EMBEDDING_MODEL}, build, atomic=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn PDFs (or extracted .txt files) into indexed JSONL context for NHP.py.")
+    parser.add_argument('documents', nargs='*', default=PIPELINE_DOCUMENTS, help="PDF or .txt files (default: PIPELINE_DOCUMENTS)")
+    parser.add_argument('--out-dir', default=PIPELINE_DIR, help="Directory for stage outputs and the pipeline state")
+    parser.add_argument('--until', choices=STAGES, default='index', help="Last stage to run")
+    parser.add_argument('--force', nargs='+', choices=STAGES + ['embed'], default=[], help="Re-run these stages even if up to date")
+    parser.add_argument('--workers', type=int, default=DOCUMENT_WORKERS, help="Documents processed at the same time")
+    parser.add_argument('--embed', action='store_true', help="Also update the paragraph embeddings NHP.py uses with USE_EMBEDDINGS")
+    parser.add_argument('--dry-run', action='store_true', help="Only report which stages would run")
+    args = parser.parse_args()
+
+    for doc in args.documents:
+        if not os.path.exists(doc):
+            parser.error(f"File not found: {doc}")
+    tracer.configure(TextCleaner.TELEMETRY_FILE)
+    pipeline = Pipeline(args.out_dir, args.until, args.force, args.dry_run, args.embed)
+    jsonl_files, failures = pipeline.run(args.documents, args.workers)
+    if jsonl_files:
+        print("\nContext files for NHP.py:\nCONTEXT_FILES = [\n" + ''.join(f"    {f!r},\n" for f in jsonl_files) + "]")
+    if failures:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from Retriever import WORD_PATTERN
+
+
+# Questions with these words usually lean on the conversation ("what about it?", "do you like...") and are never cached
+CONVERSATIONAL_WORDS = frozenset("""
+it its that this those these them they he she him her his you your yours yourself we us our
+earlier before previous again above last
+""".split())
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase and strip punctuation/extra spaces, so "How does Overcharge work?" == "how does overcharge work"."""
+    return ' '.join(WORD_PATTERN.findall(question.lower()))
+
+
+def is_cacheable(question: str) -> bool:
+    """True for standalone rules questions, False for conversation turns that depend on history."""
+    return not any(word in CONVERSATIONAL_WORDS for word in normalize_question(question).split())
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache of model answers with a time-to-live, keyed on the normalized question, a fingerprint of the
+    context it was answered from, and the model name. With an embed function, a question that is a
+    near-duplicate (cosine similarity >= similarity) of a cached one with the same context and model also hits.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 6 * 3600, embed: Callable = None, similarity: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed = embed  # question -> normalized vector (e.g. VectorStore.embed)
+        self.similarity = similarity
+        self.entries = OrderedDict()  # key -> (answer, token_msg, created, vector)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(question: str, context: str, model: str) -> Tuple[str, str, str]:
+        return (normalize_question(question), fingerprint(context), model)
+
+    def get(self, question: str, context: str, model: str) -> Optional[Tuple[str, str]]:
+        """(answer, token_msg) of a cached answer, or None."""
+        key = self.make_key(question, context, model)
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+        if self.embed is not None:
+            vector = self.embed(question)
+            with self.lock:
+                best_key, best_score = None, self.similarity
+                for other_key, (_, _, _, other_vector) in self.entries.items():
+                    if other_key[1:] != key[1:] or other_vector is None:
+                        continue
+                    score = float(vector @ other_vector)
+                    if score >= best_score:
+                        best_key, best_score = other_key, score
+                if best_key is not None:
+                    self.entries.move_to_end(best_key)
+                    self.hits += 1
+                    answer, token_msg, _, _ = self.entries[best_key]
+                    return answer, token_msg
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, question: str, context: str, model: str, answer: str, token_msg: str):
+        key = self.make_key(question, context, model)
+        vector = self.embed(question) if self.embed is not None else None
+        with self.lock:
+            self.entries[key] = (answer, token_msg, time.time(), vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _expire(self, now: float):
+        # Entries are in least-recently-used order, not creation order, so check them all
+        for key in [k for k, entry in self.entries.items() if now - entry[2] > self.ttl]:
+            del self.entries[key]
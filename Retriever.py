@@ -0,0 +1,253 @@
+import heapq
+import math
+import os
+import re
+from array import array
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from Corpus import load_store, save_store
+from Tokenizer import estimate_tokens
+
+
+# Lowercase word tokens; keeps hyphenated/apostrophe terms like "e-defense" together
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:['\-][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its
+me my no not of on or so than that the their them then there these they this to
+was we what when where which who why will with you your
+""".split())
+
+# "page 379", "pg. 12", "p 40": paragraphs from pages named in the question are always included
+PAGE_REF_PATTERN = re.compile(r'\b(?:page|pg|p)\.?\s*(\d+)\b', re.IGNORECASE)
+
+# Header words are counted this many times, so a paragraph under "LOCK ON" ranks above one that only mentions it
+HEADER_WEIGHT = 2
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Adjacent word pairs ("lock on", "heat cap", "save target") are indexed as terms of their own, and a paragraph
+# containing the exact pair scores this many times what the pair's BM25 weight alone would give
+PHRASE_WEIGHT = 2.0
+SEARCH_CANDIDATES = 200  # Paragraphs a search returns at most
+RRF_K = 60  # Reciprocal rank fusion constant for the 'hybrid' ranking: score = sum of 1 / (RRF_K + rank)
+
+INDEX_MAGIC = b'NHPBM25 1\n'
+
+
+def _numpy():
+    # Optional: with numpy a query is a few vectorized adds instead of a Python loop over every posting
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase text and split it into searchable terms."""
+    return [w for w in WORD_PATTERN.findall(text.lower()) if w not in STOPWORDS]
+
+
+def phrases(text: str) -> List[str]:
+    """Adjacent word pairs that start with a non-stopword, e.g. "Lock On" -> "lock on"."""
+    words = WORD_PATTERN.findall(text.lower())
+    return [f"{a} {b}" for a, b in zip(words, words[1:]) if a not in STOPWORDS]
+
+
+def format_paragraph(p: Dict) -> str:
+    """Format one {header, page, paragraph} record the way the model sees it."""
+    header = p.get('header', '')
+    page = p.get('page', None)
+    para = p.get('paragraph', '')
+    return f"[Header: {header}] [Page: {page}]\n{para}"
+
+
+def index_params() -> Dict:
+    # A saved index is only reused when it was built with the same scoring settings
+    return {'k1': BM25_K1, 'b': BM25_B, 'header_weight': HEADER_WEIGHT}
+
+
+class RetrievalIndex:
+    """
+    BM25 inverted index over {header, page, paragraph} records, built once and queried per question.
+    Every posting stores its finished BM25 weight, so a query only adds up weights. Postings live in flat arrays
+    (term -> slice of doc ids and weights), which save() writes to disk and open() memory-maps back.
+
+    ranking: 'lexical' (BM25 only), 'vector' (vector_store only) or 'hybrid' (both, fused by reciprocal rank).
+    Without a vector_store it is always lexical.
+    """
+
+    def __init__(self, paragraphs: Sequence[Dict], vector_store=None, ranking: str = 'hybrid', build: bool = True):
+        self.paragraphs = paragraphs
+        self.vector_store = vector_store  # Optional VectorStore already synced with these paragraphs
+        self.ranking = ranking if vector_store is not None else 'lexical'
+        self.token_counts: Dict[int, int] = {}
+        self.term_ids: Dict[str, int] = {}
+        self.starts = array('q', [0])  # Postings of term i are doc_ids/weights[starts[i]:starts[i + 1]]
+        self.doc_ids = memoryview(array('i'))
+        self.weights = memoryview(array('f'))
+        self.np = None
+        if build:
+            self._build()
+
+    def _build(self):
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)  # term -> [(doc id, term count)]
+        doc_lengths = []
+        for doc_id, p in enumerate(self.paragraphs):
+            text = p.get('paragraph', '')
+            header = p.get('header') or ''
+            terms = Counter(tokenize(text))
+            terms.update(phrases(text))
+            for term in tokenize(header) + phrases(header):
+                terms[term] += HEADER_WEIGHT
+            for term, tf in terms.items():
+                postings[term].append((doc_id, tf))
+            doc_lengths.append(sum(tf for term, tf in terms.items() if ' ' not in term) or 1)
+        n_docs = len(doc_lengths)
+        avg_length = sum(doc_lengths) / n_docs if n_docs else 1
+        doc_ids, weights = array('i'), array('f')
+        for term, items in postings.items():
+            self.term_ids[term] = len(self.term_ids)
+            idf = math.log(1 + (n_docs - len(items) + 0.5) / (len(items) + 0.5))
+            for doc_id, tf in items:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc_id] / avg_length)
+                doc_ids.append(doc_id)
+                weights.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+            self.starts.append(len(doc_ids))
+        self.doc_ids = memoryview(doc_ids)
+        self.weights = memoryview(weights)
+        self._use_numpy()
+
+    def _use_numpy(self):
+        self.np = _numpy()
+        if self.np is not None:
+            # Views of the same buffers (the mapped file after a load), not copies
+            self.np_doc_ids = self.np.frombuffer(self.doc_ids, dtype=self.np.int32)
+            self.np_weights = self.np.frombuffer(self.weights, dtype=self.np.float32)
+
+    # --- On disk (see Corpus.save_store): starts, then the mapped doc ids and weights ---
+    def save(self, path: str, key=None) -> bool:
+        """Write the postings to path; key identifies the paragraphs they were built from (see open())."""
+        meta = {
+            'key': key, 'params': index_params(), 'count': len(self.paragraphs),
+            'terms': list(self.term_ids), 'postings': len(self.doc_ids),
+        }
+        return save_store(path, INDEX_MAGIC, meta, [self.starts, self.doc_ids, self.weights])
+
+    @classmethod
+    def open(cls, paragraphs: Sequence[Dict], path: str, key=None, vector_store=None, ranking: str = 'hybrid') -> 'RetrievalIndex':
+        """Index for paragraphs, loaded from path if it was saved with the same key (built and saved otherwise)."""
+        index = cls(paragraphs, vector_store, ranking, build=False)
+        if os.path.exists(path) and index._load(path, key):
+            return index
+        index._build()
+        index.save(path, key)
+        return index
+
+    def _load(self, path: str, key) -> bool:
+        loaded = load_store(path, INDEX_MAGIC, lambda meta: [('q', len(meta['terms']) + 1)])
+        if loaded is None:
+            return False
+        meta, (starts,), view = loaded
+        if meta['key'] != key or meta['params'] != index_params() or meta['count'] != len(self.paragraphs):
+            return False
+        count = meta['postings']
+        self.term_ids = {term: i for i, term in enumerate(meta['terms'])}
+        self.starts = starts
+        if count:
+            self.doc_ids = view[:4 * count].cast('i')
+            self.weights = view[4 * count:8 * count].cast('f')
+        self._use_numpy()
+        return True
+
+    def __len__(self) -> int:
+        return len(self.paragraphs)
+
+    def idf(self, term: str) -> float:
+        """BM25 idf of a term (or word pair); 0.0 for terms that aren't in the index."""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return 0.0
+        df = self.starts[term_id + 1] - self.starts[term_id]
+        return math.log(1 + (len(self.paragraphs) - df + 0.5) / (df + 0.5))
+
+    def lexical_search(self, question: str, limit: int = SEARCH_CANDIDATES) -> List[Tuple[int, float]]:
+        """(doc id, BM25 score) of the best paragraphs for the question's words and word pairs, best first."""
+        query = dict.fromkeys(tokenize(question), 1.0)
+        query.update(dict.fromkeys(phrases(question), PHRASE_WEIGHT))
+        spans = []
+        for term, boost in query.items():
+            term_id = self.term_ids.get(term)
+            if term_id is not None:
+                spans.append((self.starts[term_id], self.starts[term_id + 1], boost))
+        if self.np is not None:
+            return self._numpy_search(spans, limit)
+        scores: Dict[int, float] = defaultdict(float)
+        for start, stop, boost in spans:
+            for doc_id, weight in zip(self.doc_ids[start:stop], self.weights[start:stop]):
+                scores[doc_id] += weight * boost
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    def _numpy_search(self, spans, limit: int) -> List[Tuple[int, float]]:
+        np = self.np
+        scores = np.zeros(len(self.paragraphs))
+        for start, stop, boost in spans:
+            scores[self.np_doc_ids[start:stop]] += self.np_weights[start:stop] * boost
+        hits = np.flatnonzero(scores)
+        if len(hits) > limit:
+            # Same cut as the pure Python path: ties at the limit go to the earliest paragraphs
+            cutoff = np.partition(scores[hits], len(hits) - limit)[len(hits) - limit]
+            above = hits[scores[hits] > cutoff]
+            hits = np.concatenate((above, hits[scores[hits] == cutoff][:limit - len(above)]))
+        order = np.lexsort((hits, -scores[hits]))
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in hits[order]]
+
+    def search(self, question: str, limit: int = SEARCH_CANDIDATES) -> List[Tuple[int, float]]:
+        """Return (doc id, score) pairs for the paragraphs that best match the question, best first."""
+        if self.ranking == 'lexical':
+            return self.lexical_search(question, limit)
+        if self.ranking == 'vector':
+            return self.vector_store.search(question, limit)
+        # Ranks, not raw scores, are combined: BM25 and cosine similarity live on different scales
+        fused: Dict[int, float] = defaultdict(float)
+        for results in (self.lexical_search(question, limit), self.vector_store.search(question, limit)):
+            for rank, (doc_id, _) in enumerate(results):
+                fused[doc_id] += 1 / (RRF_K + rank + 1)
+        return sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def page_rows(self, question: str) -> List[int]:
+        """Rows of paragraphs on pages the question refers to explicitly, each row once."""
+        rows_for_page = getattr(self.paragraphs, 'rows_for_page', None)
+        if rows_for_page is None:
+            return []
+        rows = []
+        for page in PAGE_REF_PATTERN.findall(question):
+            rows.extend(rows_for_page(int(page)))
+        # "page 5 ... page 5" (or "p. 5" and "page 5") names the same page twice
+        return list(dict.fromkeys(rows))
+
+    def select(self, question: str, token_budget: int, count_tokens: Callable[[str], int] = estimate_tokens) -> List[Dict]:
+        """Pick the highest-scoring paragraphs that fit in token_budget, returned in book order."""
+        chosen = []
+        remaining = token_budget
+        pinned = self.page_rows(question)
+        pinned_set = set(pinned)
+        candidates = pinned + [doc_id for doc_id, _ in self.search(question) if doc_id not in pinned_set]
+        for doc_id in candidates:
+            tokens = self.token_counts.get(doc_id)
+            if tokens is None:
+                tokens = count_tokens(format_paragraph(self.paragraphs[doc_id]))
+                self.token_counts[doc_id] = tokens
+            if tokens > remaining:
+                continue
+            chosen.append(doc_id)
+            remaining -= tokens
+            if remaining <= 0:
+                break
+        return [self.paragraphs[doc_id] for doc_id in sorted(chosen)]
+
+    def context_for(self, question: str, token_budget: int, count_tokens: Callable[[str], int] = estimate_tokens) -> str:
+        """Formatted context string for one question, kept under token_budget."""
+        return '\n\n'.join(format_paragraph(p) for p in self.select(question, token_budget, count_tokens))
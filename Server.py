@@ -0,0 +1,283 @@
+import asyncio
+import contextlib
+import json
+import os
+import re
+import threading
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import NHP
+from ResponseCache import is_cacheable, normalize_question
+from Telemetry import tracer
+
+
+# === USER CONFIGURABLE PARAMETERS ===
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SESSION_DIR = 'nhp_sessions'    # One conversation memory log per session, named <session>.jsonl
+MAX_MODEL_REQUESTS = 2          # Questions sent to Ollama at the same time; the rest wait in line
+MAX_QUEUED_REQUESTS = 32        # Questions allowed to wait; beyond that the server answers 503
+USE_FAKE_OLLAMA = False         # Answer with FakeOllama.FakeClient instead of a model server (for testing clients)
+# ====================================
+
+# Endpoints (JSON bodies, one request per connection):
+#   POST   /ask      {"session": "...", "question": "..."}  -> {"answer": "...", "token_msg": "..."}
+#   POST   /stream   {"session": "...", "question": "..."}  -> NDJSON lines {"chunk": "..."}, then {"done": true, "token_msg": "..."}
+#   GET    /memory?session=...                               -> {"session", "summary", "messages"}
+#   DELETE /memory?session=...                               -> forget the session's conversation
+#   GET    /health
+
+SESSION_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class NHPServer:
+    """
+    Serves ask_ollama to several players at once. The corpus, retrieval index, stat tables and response cache
+    are loaded once and shared; every session gets its own ConversationMemory. At most MAX_MODEL_REQUESTS
+    questions run against the model at a time, and identical standalone questions that arrive while one is
+    already being answered wait for that answer instead of asking again.
+    """
+
+    def __init__(self, client=None, save_model_info=True):
+        self.client = client
+        NHP.start_model_info_refresh(NHP.OLLAMA_MODEL, client, save=save_model_info)
+        corpus = NHP.load_corpus()
+        self.context = corpus['rag_context']
+        self.ask_ollama = partial(corpus['ask_ollama'], model=NHP.OLLAMA_MODEL, client=client)
+        self.sessions = {}  # session -> ConversationMemory
+        self.session_locks = {}  # session -> asyncio.Lock, so one session's turns stay in order
+        self.inflight = {}  # normalized question -> Future of (answer, token_msg)
+        self.model_slots = asyncio.Semaphore(MAX_MODEL_REQUESTS)
+        self.waiting = 0
+        os.makedirs(SESSION_DIR, exist_ok=True)
+
+    # --- Sessions ---
+    def memory(self, session: str):
+        if not session or not SESSION_PATTERN.match(session):
+            raise HttpError(400, "session must be 1-64 letters, digits, '-' or '_'")
+        if session not in self.sessions:
+            self.sessions[session] = NHP.load_memory(os.path.join(SESSION_DIR, f"{session}.jsonl"), client=self.client)
+            self.session_locks[session] = asyncio.Lock()
+        return self.sessions[session]
+
+    @contextlib.asynccontextmanager
+    async def model_slot(self):
+        if self.waiting >= MAX_QUEUED_REQUESTS:
+            raise HttpError(503, "Too many questions waiting, try again later")
+        self.waiting += 1
+        try:
+            with tracer.span('server.queue_wait'):
+                await self.model_slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.model_slots.release()
+
+    async def remember(self, memory, question: str, answer: str):
+        memory.append({"role": "user", "content": question})
+        memory.append({"role": "assistant", "content": answer})
+        await asyncio.get_running_loop().run_in_executor(None, NHP.save_memory, memory)
+
+    # --- Endpoints ---
+    async def ask(self, session: str, question: str):
+        memory = self.memory(session)
+        loop = asyncio.get_running_loop()
+        async with self.session_locks[session]:
+            key = normalize_question(question) if is_cacheable(question) else None
+            shared = self.inflight.get(key) if key else None
+            if shared is not None:
+                answer, token_msg = await asyncio.shield(shared)
+                token_msg = "[Shared answer to an identical question in progress]\n" + token_msg
+            else:
+                future = loop.create_future()
+                if key:
+                    self.inflight[key] = future
+                try:
+                    async with self.model_slot():
+                        answer, token_msg = await loop.run_in_executor(None, self.ask_ollama, self.context, question, memory)
+                    future.set_result((answer, token_msg))
+                except Exception as e:
+                    future.set_exception(e)
+                    future.exception()  # Marks it retrieved when nobody else was waiting
+                    raise
+                finally:
+                    if key:
+                        self.inflight.pop(key, None)
+            await self.remember(memory, question, answer)
+        return {"answer": answer, "token_msg": token_msg}
+
+    async def stream(self, session: str, question: str, writer):
+        memory = self.memory(session)
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        done = object()
+        gone = threading.Event()  # Set when the client disconnects, so the producer stops reading the model's stream
+
+        def produce():
+            # Runs in a worker thread; every chunk is handed to the event loop as soon as it arrives
+            token_msg = ""
+            try:
+                parts, token_msg = self.ask_ollama(self.context, question, memory, stream=True)
+                for part in parts:
+                    if gone.is_set():
+                        if hasattr(parts, 'close'):
+                            parts.close()  # Ends the model's stream instead of generating the rest for nobody
+                        break
+                    if part:
+                        loop.call_soon_threadsafe(chunks.put_nowait, part)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, f"[Error: {e}]")
+            loop.call_soon_threadsafe(chunks.put_nowait, (done, token_msg))
+
+        async def send(line):
+            if gone.is_set():
+                return
+            try:
+                writer.write((json.dumps(line, ensure_ascii=False) + '\n').encode('utf-8'))
+                await writer.drain()
+            except ConnectionError:
+                gone.set()
+
+        async with self.session_locks[session]:
+            async with self.model_slot():
+                write_head(writer, 200, 'application/x-ndjson')
+                producer = loop.run_in_executor(None, produce)
+                parts = []
+                finished = False
+                try:
+                    while True:
+                        item = await chunks.get()
+                        if isinstance(item, tuple) and item[0] is done:
+                            token_msg = item[1]
+                            finished = True
+                            break
+                        parts.append(item)
+                        await send({"chunk": item})
+                finally:
+                    # The slot is only given back once the producer has stopped using the model
+                    if not finished:
+                        gone.set()
+                    await producer
+            # What was generated is kept even if the client left halfway through
+            await self.remember(memory, question, ''.join(parts))
+            await send({"done": True, "token_msg": token_msg})
+
+    async def get_memory(self, session: str):
+        memory = self.memory(session)
+        return {"session": session, "summary": memory.summary, "messages": list(memory)}
+
+    async def delete_memory(self, session: str):
+        self.memory(session)
+        async with self.session_locks[session]:
+            self.sessions.pop(session).forget()
+        return {"session": session, "deleted": True}
+
+    # --- HTTP ---
+    async def handle(self, reader, writer):
+        try:
+            method, path, query, body = await read_request(reader)
+            session = (query.get('session') or [body.get('session', '')])[0]
+            if path == '/health':
+                send_json(writer, 200, {"status": "ok", "sessions": len(self.sessions), "waiting": self.waiting})
+            elif path in ('/ask', '/stream'):
+                if method != 'POST':
+                    raise HttpError(405, "Use POST")
+                question = body.get('question', '')
+                if not isinstance(question, str) or not question.strip():
+                    raise HttpError(400, "question is required")
+                if path == '/ask':
+                    send_json(writer, 200, await self.ask(session, question))
+                else:
+                    await self.stream(session, question, writer)
+            elif path == '/memory':
+                if method == 'GET':
+                    send_json(writer, 200, await self.get_memory(session))
+                elif method == 'DELETE':
+                    send_json(writer, 200, await self.delete_memory(session))
+                else:
+                    raise HttpError(405, "Use GET or DELETE")
+            else:
+                raise HttpError(404, f"No endpoint {path}")
+        except HttpError as e:
+            send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            send_json(writer, 500, {"error": str(e)})
+        finally:
+            with contextlib.suppress(ConnectionError):
+                await writer.drain()
+            writer.close()
+
+
+async def read_request(reader):
+    """(method, path, query dict, JSON body dict) of one HTTP request."""
+    request_line = await reader.readline()
+    try:
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    body = {}
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError:
+            raise HttpError(400, "Body must be JSON")
+        if not isinstance(body, dict):
+            raise HttpError(400, "Body must be a JSON object")
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), body
+
+
+def write_head(writer, status: int, content_type: str, length: int = None):
+    head = f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Error')}\r\nContent-Type: {content_type}; charset=utf-8\r\nConnection: close\r\n"
+    if length is not None:
+        head += f"Content-Length: {length}\r\n"
+    writer.write((head + "\r\n").encode('latin-1'))
+
+
+def send_json(writer, status: int, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    write_head(writer, status, 'application/json', len(data))
+    writer.write(data)
+
+
+async def serve(host: str = SERVER_HOST, port: int = SERVER_PORT, client=None, save_model_info=True):
+    nhp_server = NHPServer(client, save_model_info)
+    server = await asyncio.start_server(nhp_server.handle, host, port)
+    print(f"NHP server listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    client = None
+    if USE_FAKE_OLLAMA:
+        from FakeOllama import FakeClient
+        client = FakeClient(first_token_delay=0.2, chunk_delay=0.02)
+    tracer.configure(NHP.TELEMETRY_FILE)
+    try:
+        # The fake client's model info is made up, so it is never saved over the real one
+        asyncio.run(serve(client=client, save_model_info=not USE_FAKE_OLLAMA))
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        exit(1)
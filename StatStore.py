@@ -0,0 +1,104 @@
+import json
+import re
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+
+# Words a question may use for each statblock category (TableExtractor.Categories)
+StatAliases = {
+    "Hull": ["hull"],
+    "Agility": ["agility", "agi"],
+    "Systems": ["systems", "sys"],
+    "Engineering": ["engineering", "eng"],
+    "HP": ["hp", "hit points", "health"],
+    "Evasion": ["evasion", "eva"],
+    "Speed": ["speed", "movement"],
+    "HeatCap": ["heat cap", "heat capacity", "heatcap"],
+    "Sensors": ["sensors", "sensor range"],
+    "Armor": ["armor", "armour"],
+    "EDefense": ["e-defense", "e defense", "edefense", "edef", "electronic defense"],
+    "Size": ["size"],
+    "SaveTarget": ["save target"],
+}
+DisplayNames = {"HeatCap": "Heat Cap", "EDefense": "E-Defense", "SaveTarget": "Save Target"}
+
+TierPattern = re.compile(r'\b(?:tier|t)\s*([123])\b', re.IGNORECASE)
+AliasPattern = re.compile(
+    r'\b(' + '|'.join(re.escape(alias) for alias in sorted((a for aliases in StatAliases.values() for a in aliases), key=len, reverse=True)) + r')\b',
+    re.IGNORECASE
+)
+AliasToCategory = {alias: category for category, aliases in StatAliases.items() for alias in aliases}
+
+# What a question asked for: the statblock, the categories mentioned (may be empty) and the tier (None = all tiers)
+StatQuery = namedtuple('StatQuery', ['name', 'categories', 'tier'])
+
+
+class StatStore:
+    """
+    In-memory index of mech/NPC statblocks, loaded from TableExtractor output
+    (Table.json-style {Mech: {Category: [T1, T2, T3]}} files or StatBlocks.jsonl records).
+    """
+
+    def __init__(self):
+        self.blocks: Dict[str, Dict] = {}  # lowercase name -> {"name", "page", "stats"}
+        self._name_pattern = None
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def add(self, name: str, stats: Dict[str, List], page: Optional[int] = None):
+        if name:
+            self.blocks[name.lower()] = {"name": name, "page": page, "stats": stats}
+            self._name_pattern = None
+
+    def load(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.lower().endswith('.jsonl'):
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.add(record['name'], record['stats'], record.get('page'))
+            else:
+                for name, stats in json.load(f).items():
+                    self.add(name, stats)
+
+    def match(self, question: str) -> Optional[StatQuery]:
+        """Find the statblock a question is about, plus any stat categories and tier it names."""
+        if not self.blocks:
+            return None
+        if self._name_pattern is None:
+            names = sorted(self.blocks, key=len, reverse=True)
+            self._name_pattern = re.compile(r'\b(' + '|'.join(re.escape(n) for n in names) + r')\b', re.IGNORECASE)
+        name_match = self._name_pattern.search(question)
+        if not name_match:
+            return None
+        categories = []
+        for alias in AliasPattern.findall(question):
+            category = AliasToCategory[alias.lower()]
+            if category not in categories:
+                categories.append(category)
+        tier_match = TierPattern.search(question)
+        return StatQuery(name_match.group(1).lower(), categories, int(tier_match.group(1)) if tier_match else None)
+
+    def _values(self, block, category, tier):
+        values = block['stats'].get(category) or []
+        if tier is not None:
+            value = values[tier - 1] if tier <= len(values) else None
+            return f"{value}" if value is not None else "unknown"
+        return ' / '.join(str(v) for v in values) + " (Tier 1 / 2 / 3)"
+
+    def answer(self, query: StatQuery) -> str:
+        """Plain answer for the categories the question asked about."""
+        block = self.blocks[query.name]
+        tier = f" at Tier {query.tier}" if query.tier else ""
+        parts = [f"{DisplayNames.get(c, c)} {self._values(block, c, query.tier)}" for c in query.categories]
+        source = f" (statblock, page {block['page']})" if block['page'] is not None else " (statblock)"
+        return f"{block['name']}{tier}: " + ', '.join(parts) + source + "."
+
+    def row_context(self, query: StatQuery) -> str:
+        """The statblock (or just the asked-for rows) formatted as context for the model."""
+        block = self.blocks[query.name]
+        categories = query.categories or list(block['stats'])
+        lines = [f"{DisplayNames.get(c, c)}: {self._values(block, c, query.tier)}" for c in categories]
+        tier = f" (Tier {query.tier})" if query.tier else ""
+        return f"[Header: {block['name'].upper()} STATBLOCK{tier}] [Page: {block['page']}]\n" + '\n'.join(lines)
@@ -3,73 +3,116 @@ import re
 import pathlib
 
 
+# === USER CONFIGURABLE PARAMETERS ===
+# Toggle: if True, scan INPUT_FILE for every statblock table and write one JSONL record per mech/NPC to STATBLOCK_FILE;
+# if False, run JSONifyTable on the single example table below and write Table.json
+BATCH_MODE = True
+INPUT_FILE = 'Output NHP.txt'
+STATBLOCK_FILE = 'StatBlocks.jsonl'
+# ====================================
+
+
 '''
 What we want to do:
-Split by \n
-Remove the first 5 columns to prevent confusion with TIER 1, 2, and 3, and last column to make sure everything works nice
-Remove first and last "|" pipe and split by pipe
-Strip everything but the numbers (and negatives) to leave a list of 3 numbers (special case for 1/2, or mechs that are 1/2 OR 1)
-Match each list with corresponding line item (Hull, Agility, Systems, etc.)
+Walk the extracted text line by line, picking out grid tables (+---+ borders, | cell | rows)
+Split each row into cells; each column is one tier (TIER 1, 2, and 3)
+Match every "Label: value" cell against the known stat names (Hull, Agility, Systems, etc.), skip everything else (TIER, MECH SKILLS, CORE STATS)
+Keep the numbers (and negatives), with the special cases for Size 1/2 and 1/2 or 1
+Tables with enough known stats are statblocks; name them after the line just above the table
 Convert to JSON and return
 '''
 
 
+Categories = ["Hull", "Agility", "Systems", "Engineering", "HP", "Evasion", "Speed", "HeatCap", "Sensors", "Armor", "EDefense", "Size", "SaveTarget"]
+CategoryNames = {
+    "hull": "Hull", "agility": "Agility", "systems": "Systems", "engineering": "Engineering",
+    "hp": "HP", "evasion": "Evasion", "speed": "Speed", "heat cap": "HeatCap", "sensors": "Sensors",
+    "armor": "Armor", "e-defense": "EDefense", "size": "Size", "save target": "SaveTarget"
+}
+MinStats = 8 # A table needs at least this many known stats in its first column to count as a statblock
+
+BorderPattern = re.compile(r'^\s*\+[-=+:]*\+\s*$')
+RowPattern = re.compile(r'^\s*\|.*\|\s*$')
+# "Hull: –2", "Agility: +3", "Size: 1/2 or 1" (the book uses an en dash for negatives)
+StatPattern = re.compile(r'^(?P<Label>[A-Za-z][A-Za-z -]*?)\s*:\s*(?P<Value>[+\-–]?\s*\d+(?:/\d+)?(?:\s+or\s+\d+(?:/\d+)?)?)$')
+PagePattern = re.compile(r'^\[(\d+)\]$')
+
+
+def ParseValue(Value):
+    Value = Value.replace('–', '-').replace('+', '').replace(' ', '') # Betcha AI couldn't figure that one out
+    if re.fullmatch(r'-?\d+', Value):
+        return int(Value)
+    return Value.replace('or', ' or ') # Special sizes stay as text: "1/2", "1/2 or 1"
+
+
+def ParseStatTable(Rows):
+    """Turn the cell rows of one grid table into {Category: [Tier 1, Tier 2, Tier 3]}, or None if it isn't a statblock."""
+    Columns = max((len(Row) for Row in Rows), default=0)
+    Schema = {}
+    for Row in Rows:
+        for Tier, Cell in enumerate(Row):
+            Match = StatPattern.match(Cell)
+            if not Match:
+                continue
+            Category = CategoryNames.get(Match.group('Label').lower())
+            if Category:
+                Schema.setdefault(Category, [None] * Columns)[Tier] = ParseValue(Match.group('Value'))
+    if sum(1 for Values in Schema.values() if Values[0] is not None) < MinStats:
+        return None
+    return {Category: Schema[Category] for Category in Categories if Category in Schema}
+
+
+def IterTables(Lines):
+    """Small state machine over text lines: yields (name, page, rows of cells) for every grid table."""
+    Name = None
+    Page = None
+    Rows = None # None while outside a table
+    for Line in Lines:
+        Line = Line.rstrip('\n')
+        Stripped = Line.strip()
+        if Rows is not None:
+            if RowPattern.match(Line):
+                Rows.append([Cell.strip() for Cell in Stripped[1:-1].split('|')])
+                continue
+            if BorderPattern.match(Line):
+                continue
+            yield Name, Page, Rows
+            Rows = None
+        if BorderPattern.match(Line):
+            Rows = []
+        elif PagePattern.match(Stripped):
+            Page = int(Stripped[1:-1])
+        elif Stripped:
+            Name = Stripped.strip('#* ') # The statblock's name is the last text line above the table
+    if Rows is not None:
+        yield Name, Page, Rows
+
+
+def IterStatBlocks(Lines):
+    """Yield one {name, page, stats} record per statblock table found in the lines."""
+    for Name, Page, Rows in IterTables(Lines):
+        Stats = ParseStatTable(Rows)
+        if Stats:
+            yield {"name": Name, "page": Page, "stats": Stats}
+
+
+def ExtractStatBlocks(InputPath, OutputPath):
+    """Scan a whole extracted book and write every statblock to a JSONL file. Returns how many were found."""
+    Count = 0
+    with open(InputPath, 'r', encoding='utf-8') as InputFile, open(OutputPath, 'w', encoding='utf-8') as OutputFile:
+        for Record in IterStatBlocks(InputFile):
+            OutputFile.write(json.dumps(Record, ensure_ascii=False) + '\n')
+            Count += 1
+    return Count
+
+
 def JSONifyTable(Mech, Table):
-    # Handle special Size Cases (Size 1/2; Size 1/2 or 1)
-    # Remeber, size is always the same between Tiers, so we can just detect if one or the other is there and then drop the row\
-    SpecialSize = 0 # 0 for none
-    if "1/2 or 1" in Table:
-        SpecialSize = "1/2 or 1"
-    elif "1/2" in Table:
-        SpecialSize = "1/2"
-
-
-    Table = Table.split("\n")
-
-    Table = Table[6:19] # All stat tables are the same so we don't have to worry about it
-    del Table[4] # Get rid of the row that says CORE STATS
-
-    for x, Row in enumerate(Table):
-        Table[x] = Row.split("|")
-
-    for x, Row in enumerate(Table):
-        Table[x] = [x for x in Row if x]
-
-    # Table = [x for x in Table if x]
-    for Row in Table:
-        for x, Tier in enumerate(Row):
-            if not "E-Defense" in Tier:
-                Match = re.sub(r"[A-z :+]", "", Tier)
-            else:
-                Match = re.sub(r"[A-z :+-]", "", Tier)
-            if SpecialSize != 0 and "Size" in Tier:
-                Match = SpecialSize
-            if Match:
-                Row[x] = Match #.group(0)
-    
-    
-    Categories = ["Hull", "Agility", "Systems", "Engineering", "HP", "Evasion", "Speed", "HeatCap", "Sensors", "Armor", "EDefense", "Size", "SaveTarget"]
-    Schema = {
-    Mech: {
-        Category: [0, 0, 0] for Category in Categories
-    }
-    }
-    for i, Row in enumerate(Table):
-        for j, Value in enumerate(Row):
-            Schema[Mech][Categories[i]][j] = int(Table[i][j].replace('–', '-')) # Betcha AI couldn't figure that one out
-
-    '''
-    for i, Row in enumerate(Table):
-        for j, Category in enumerate(Categories):
-            print(Category)
-            print(j)
-            print(Row)
-            Schema[Mech][Category][j] = int(Table[i][j].replace('–', '-'))
-    '''
-    
-    # .replace('–', '-')
-    
-    return Schema
+    """Parse a single statblock table given as a string, returning {Mech: {Category: [Tier 1, Tier 2, Tier 3]}}."""
+    for _, _, Rows in IterTables(Table.split("\n")):
+        Stats = ParseStatTable(Rows)
+        if Stats:
+            return {Mech: Stats}
+    return {Mech: {}}
 
 
 Table = """+-----------------+-----------------+-----------------+
@@ -95,12 +138,16 @@ Table = """+-----------------+-----------------+-----------------+
 +-----------------+-----------------+-----------------+
 """
 
-Table = JSONifyTable("Ace", Table)
-print(Table)
-
+if __name__ == '__main__':
+    if BATCH_MODE:
+        Count = ExtractStatBlocks(INPUT_FILE, STATBLOCK_FILE)
+        print(f"Found {Count} statblocks in {INPUT_FILE}, written to {STATBLOCK_FILE}")
+    else:
+        Table = JSONifyTable("Ace", Table)
+        print(Table)
 
-with open("Table.json", "w") as json_file:
-    json.dump(Table, json_file, indent=4)
+        with open("Table.json", "w") as json_file:
+            json.dump(Table, json_file, indent=4)
 
 # Text = str(Table)
 # pathlib.Path("TableOutput.txt").write_bytes(Text.encode()) # type: ignore
\ No newline at end of file
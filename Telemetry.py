@@ -0,0 +1,172 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+# === USER CONFIGURABLE PARAMETERS ===
+TELEMETRY_FILE = 'nhp_telemetry.jsonl'  # Default log for `python Telemetry.py`
+TELEMETRY_MAX_MB = 20                   # The log is rotated to <file>.1 past this size
+# ====================================
+
+# Timing fields Ollama returns with every (final) chat response; durations are in nanoseconds
+OLLAMA_TIMING_FIELDS = ['total_duration', 'load_duration', 'prompt_eval_count', 'prompt_eval_duration', 'eval_count', 'eval_duration']
+
+
+class Tracer:
+    """
+    Appends one JSON line per timed stage or counter to a rolling log file: {"ts", "stage", "ms", ...fields}.
+    With no path it does nothing, so instrumented code costs only a couple of perf_counter() calls.
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = TELEMETRY_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.counters: Dict[str, int] = {}
+
+    def configure(self, path: str, max_bytes: int = None):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+            self.path = path
+            if max_bytes:
+                self.max_bytes = max_bytes
+
+    def record(self, stage: str, ms: float = None, **fields):
+        if not self.path:
+            return
+        entry = {'ts': round(time.time(), 3), 'stage': stage}
+        if ms is not None:
+            entry['ms'] = round(ms, 3)
+        entry.update(fields)
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(line)
+            self.file.flush()
+            if self.file.tell() > self.max_bytes:
+                self.file.close()
+                self.file = None
+                os.replace(self.path, self.path + '.1')
+
+    @contextmanager
+    def span(self, stage: str, **fields):
+        """Time the with-block as one `stage` entry; the yielded dict can be filled with extra fields."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000, **fields)
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        self.record(name, count=n)
+
+
+# Shared tracer; the entry points (NHP.py, Server.py, TextCleaner.py, Pipeline.py) point it at their TELEMETRY_FILE
+tracer = Tracer()
+
+
+def server_timing(response) -> Dict:
+    """Ollama's timing/token fields from a chat response (or the last streamed part), without the missing ones."""
+    timing = {}
+    for field in OLLAMA_TIMING_FIELDS:
+        try:
+            value = response[field]
+        except (KeyError, TypeError):
+            continue
+        if value is not None:
+            timing[field] = value
+    return timing
+
+
+# --- Summary ---
+def load_entries(path: str) -> List[Dict]:
+    entries = []
+    for p in (path + '.1', path):
+        if os.path.exists(p):
+            with open(p, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+    return entries
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def summarize(entries: List[Dict]) -> List[Dict]:
+    """Per stage: calls, p50/p95/max ms, and for model calls prompt-eval and generation tokens/sec."""
+    stages: Dict[str, List[Dict]] = {}
+    for entry in entries:
+        stages.setdefault(entry['stage'], []).append(entry)
+    rows = []
+    for stage, items in sorted(stages.items()):
+        times = [e['ms'] for e in items if 'ms' in e]
+        row = {'stage': stage, 'calls': len(items)}
+        if times:
+            row.update(p50_ms=percentile(times, 0.5), p95_ms=percentile(times, 0.95), max_ms=max(times))
+        else:
+            row['count'] = sum(e.get('count', 1) for e in items)
+        for tokens, duration, name in (('prompt_eval_count', 'prompt_eval_duration', 'prompt_tok_s'), ('eval_count', 'eval_duration', 'gen_tok_s')):
+            total_tokens = sum(e.get(tokens, 0) for e in items)
+            total_ns = sum(e.get(duration, 0) for e in items)
+            if total_ns:
+                row[name] = total_tokens / (total_ns / 1e9)
+        rows.append(row)
+    return rows
+
+
+def export_csv(entries: List[Dict], csv_path: str):
+    columns = ['ts', 'stage', 'ms'] + sorted({k for e in entries for k in e} - {'ts', 'stage', 'ms'})
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(entries)
+
+
+def print_summary(rows: List[Dict]):
+    print(f"{'stage':<22}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'prompt tok/s':>14}{'gen tok/s':>11}")
+    for row in rows:
+        if 'p50_ms' not in row:
+            print(f"{row['stage']:<22}{row['calls']:>7}   (counter, total {row['count']})")
+            continue
+        prompt_rate = f"{row['prompt_tok_s']:.0f}" if 'prompt_tok_s' in row else '-'
+        gen_rate = f"{row['gen_tok_s']:.1f}" if 'gen_tok_s' in row else '-'
+        print(f"{row['stage']:<22}{row['calls']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['max_ms']:>10.1f}{prompt_rate:>14}{gen_rate:>11}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize the NHP telemetry log: p50/p95 latency per stage and model tokens/sec.")
+    parser.add_argument('log', nargs='?', default=TELEMETRY_FILE)
+    parser.add_argument('--stage', help="Only entries whose stage starts with this")
+    parser.add_argument('--csv', help="Also write the raw entries to this CSV file")
+    args = parser.parse_args()
+    entries = load_entries(args.log)
+    if args.stage:
+        entries = [e for e in entries if e['stage'].startswith(args.stage)]
+    if not entries:
+        print(f"No telemetry in {args.log}")
+    else:
+        print_summary(summarize(entries))
+        if args.csv:
+            export_csv(entries, args.csv)
+            print(f"Wrote {len(entries)} entries to {args.csv}")
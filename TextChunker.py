@@ -1,12 +1,11 @@
 import re
 import json
 
-def parse_output_txt(input_path, output_path):
-    with open(input_path, 'r', encoding='utf-8') as f:
-        text = f.read()
+# A table border or row ("+---+", "| a | b |"); shared by OcrDamage, TextCleaner and ContextCompressor
+TABLE_LINE_PATTERN = re.compile(r'^[ \t]*[+|].*[+|][ \t]*$')
 
-    # Split into lines and process
-    lines = text.split('\n')
+def iter_paragraphs(lines):
+    """Yield {header, page, paragraph} records from cleaned text lines (a list or an open file) as they are parsed."""
     header = None
     page = None
     paragraphs = []
@@ -28,6 +27,10 @@ def parse_output_txt(input_path, output_path):
             buffer = []
 
     for line in lines:
+        # Hand finished paragraphs out right away instead of keeping the whole document
+        yield from paragraphs
+        paragraphs.clear()
+        line = line.rstrip('\n')
         # Check for page number
         page_match = page_pattern.search(line)
         if page_match:
@@ -48,10 +51,16 @@ def parse_output_txt(input_path, output_path):
             buffer.append(line)
 
     flush_buffer()  # Flush any remaining buffer
+    yield from paragraphs
+
+def parse_paragraphs(text):
+    """Split cleaned text into a list of {header, page, paragraph} records."""
+    return list(iter_paragraphs(text.split('\n')))
 
-    # Write to JSONL
-    with open(output_path, 'w', encoding='utf-8') as out:
-        for para in paragraphs:
+def parse_output_txt(input_path, output_path):
+    # Records are written as they are parsed, so memory use doesn't grow with the book
+    with open(input_path, 'r', encoding='utf-8') as f, open(output_path, 'w', encoding='utf-8') as out:
+        for para in iter_paragraphs(f):
             out.write(json.dumps(para, ensure_ascii=False) + '\n')
 
 if __name__ == "__main__":
@@ -1,12 +1,19 @@
-
 import os
 import ollama
 import math
+import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from CleanCache import CleanCache
+from OcrDamage import DAMAGE_THRESHOLD, document_vocabulary, drift, iter_damage, load_dictionary, score_chunks
+from Telemetry import tracer, server_timing
+from TextChunker import TABLE_LINE_PATTERN
 
 # === USER CONFIGURABLE PARAMETERS ===
 # Edit these variables in the editor before running
 TXT_FILE = 'output3.txt'  # Path to TXT file to clean
 OLLAMA_MODEL = 'llama3'   # Ollama model to use
+OLLAMA_OPTIONS = {}       # Generation options passed to Ollama (e.g. {'temperature': 0}); part of the cache key
 # Prompt instructs the model to ONLY output the cleaned text, with no extra explanation or formatting
 CLEAN_PROMPT = (
     'Clean up the following text for clarity and formatting. Remove any OCR errors, fix paragraph breaks, and ensure the text is readable. Output ONLY the cleaned text, with no extra explanation, commentary, or formatting. Do not alter the structure of the text, or the content of the text, unless obviously disrupted by OCR.'
@@ -15,123 +22,362 @@ CHUNK_SIZE = 1500         # Chunk size in characters
 OUTPUT_FILE = "2-CleanedText 10-37.txt"        # Output file for cleaned text, or None to print
 # Toggle: if True, chunk by page (using page numbers as identifiers); if False, use improved paragraph/table chunking
 CHUNK_BY_PAGE = True
-# Toggle: if True, review each chunk before sending to Ollama
+# Toggle: if True, review each chunk before sending to Ollama (runs as a pre-pass, before any cleaning starts)
 DEBUG_REVIEW_CHUNKS = True
+# Number of cleaning requests kept in flight at once. Ollama only runs them in parallel up to its OLLAMA_NUM_PARALLEL setting.
+PIPELINE_WORKERS = 4
+# Checkpoint journal: every finished chunk is appended here, and a rerun skips chunks already in it (deleted once a run
+# completes). None = derive from OUTPUT_FILE/TXT_FILE.
+JOURNAL_FILE = None
+# Cache of cleaning results keyed by (chunk, prompt, model, options): unchanged chunks never go back to Ollama. None = no cache.
+CACHE_FILE = 'clean_cache.sqlite'
+CACHE_MAX_MB = 512        # Least recently used results are evicted past this size
+# Per-chunk timings (including Ollama's prompt/generation counts) are appended here; `python Telemetry.py` summarizes them. None = off.
+TELEMETRY_FILE = 'nhp_telemetry.jsonl'
+# OCR pre-filter: chunks the local detector in OcrDamage.py scores below this already read cleanly and are kept as they are,
+# without a model call. Tune it with `python OcrDamage.py <file>`. None = send every chunk to the model.
+OCR_DAMAGE_THRESHOLD = DAMAGE_THRESHOLD
+# A cleaned chunk whose words differ from the original by more than this share is rejected and the original kept
+# (the model rewrote or invented text instead of fixing it). None = accept every answer.
+MAX_CLEAN_DRIFT = 0.3
 
 
 # ====================================
 
 
 import re
+from collections import namedtuple
+
+# One chunk from iter_chunks: its text, the character offset of its first line in the input,
+# and the last [N] page marker seen before it (None before the first marker)
+Chunk = namedtuple('Chunk', ['text', 'offset', 'page'])
+
+PAGE_NUMBER_PATTERN = re.compile(r'^\[(\d+)\]$')
+
+def is_table_line(line):
+    # Detect table lines by looking for lines with lots of | or + or table-like structure
+    if line.count('|') >= 2:
+        return True
+    return ('+' in line or '|' in line) and TABLE_LINE_PATTERN.match(line) is not None
+
+def split_lines(text):
+    """Yield the lines of text one at a time, without building the whole split list up front."""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def iter_chunks(lines, chunk_size=1500, by_page=False):
+    """
+    Streaming version of chunk_text: takes any iterable of lines (a list, split_lines(text), or an open file)
+    and yields Chunk tuples as soon as each chunk is complete. Each line is classified exactly once.
+    """
+    if by_page:
+        return _iter_page_chunks(lines)
+    return _iter_paragraph_chunks(lines, chunk_size)
+
+def _iter_page_chunks(lines):
+    # Split by lines that are exactly a page number in brackets (e.g., [10])
+    match_page = PAGE_NUMBER_PATTERN.match
+    current = []
+    append = current.append
+    offset = start = 0
+    page = start_page = None
+    for raw in lines:
+        line = raw.rstrip('\n')
+        if '[' in line:
+            page_match = match_page(line.strip())
+            if page_match:
+                if current:
+                    text = '\n'.join(current).strip()
+                    if text:
+                        yield Chunk(text, start, start_page)
+                    current.clear()
+                page = int(page_match.group(1))
+                offset += len(line) + 1
+                continue
+        if not current:
+            start, start_page = offset, page
+        append(line)
+        offset += len(line) + 1
+    if current:
+        text = '\n'.join(current).strip()
+        if text:
+            yield Chunk(text, start, start_page)
+
+def _iter_paragraph_chunks(lines, chunk_size):
+    # Improved paragraph/table detection
+    match_page = PAGE_NUMBER_PATTERN.match
+    current = []
+    current_len = 0
+    in_table = False
+    offset = start = 0
+    page = start_page = None
+    for raw in lines:
+        line = raw.rstrip('\n')
+        line_offset = offset
+        offset += len(line) + 1
+        stripped = line.strip()
+        if stripped[:1] == '[':
+            page_match = match_page(stripped)
+            if page_match:
+                page = int(page_match.group(1))
+        table_line = is_table_line(line)
+        if in_table and not table_line:
+            # The previous line was the last line of a table, flush the table chunk
+            yield Chunk('\n'.join(current), start, start_page)
+            current = []
+            current_len = 0
+            in_table = False
+        if table_line:
+            if not in_table and current:
+                # Flush current paragraph chunk before starting table
+                yield Chunk('\n'.join(current), start, start_page)
+                current = []
+                current_len = 0
+            in_table = True
+            if not current:
+                start, start_page = line_offset, page
+            current.append(line)
+            current_len += len(line) + 1
+        elif not stripped:
+            if current:
+                yield Chunk('\n'.join(current), start, start_page)
+                current = []
+                current_len = 0
+            in_table = False
+        else:
+            if not current:
+                start, start_page = line_offset, page
+            current.append(line)
+            current_len += len(line) + 1
+            if current_len > chunk_size:
+                yield Chunk('\n'.join(current), start, start_page)
+                current = []
+                current_len = 0
+    # Table and paragraph chunks always hold a non-blank line, so unlike page chunks they never need filtering
+    if current:
+        yield Chunk('\n'.join(current), start, start_page)
 
 def chunk_text(text, chunk_size=1500, by_page=False):
     """
     Split text into chunks. If by_page is True, split by detected page numbers (e.g., [10]),
     otherwise split by improved paragraph/table detection and chunk size.
     """
-    if by_page:
-        # Split by lines that are exactly a page number in brackets (e.g., [10])
-        lines = text.split('\n')
-        pages = []
-        current = []
-        page_number_pattern = re.compile(r'^\[\d+\]$')
-        for line in lines:
-            if page_number_pattern.match(line.strip()):
-                if current:
-                    pages.append('\n'.join(current).strip())
-                    current = []
-            else:
-                current.append(line)
-        if current:
-            pages.append('\n'.join(current).strip())
-        return [p for p in pages if p.strip()]
-    else:
-        # Improved paragraph/table detection
-        lines = text.split('\n')
-        chunks = []
-        current = []
-        current_len = 0
-        in_table = False
-        for i, line in enumerate(lines):
-            # Detect table start/end by looking for lines with lots of | or + or table-like structure
-            is_table_line = bool(re.match(r'^[ \t]*[+|].*[+|][ \t]*$', line)) or (line.count('|') >= 2)
-            if is_table_line:
-                if not in_table and current:
-                    # Flush current paragraph chunk before starting table
-                    chunks.append('\n'.join(current))
-                    current = []
-                    current_len = 0
-                in_table = True
-                current.append(line)
-                current_len += len(line) + 1
-                # If next line is not a table, flush table chunk
-                if i+1 == len(lines) or not (bool(re.match(r'^[ \t]*[+|].*[+|][ \t]*$', lines[i+1])) or (lines[i+1].count('|') >= 2)):
-                    chunks.append('\n'.join(current))
-                    current = []
-                    current_len = 0
-                    in_table = False
-            elif line.strip() == '':
-                if current:
-                    chunks.append('\n'.join(current))
-                    current = []
-                    current_len = 0
-                in_table = False
-            else:
-                current.append(line)
-                current_len += len(line) + 1
-                if current_len > chunk_size and current:
-                    chunks.append('\n'.join(current))
-                    current = []
-                    current_len = 0
-        if current:
-            chunks.append('\n'.join(current))
-        return [c for c in chunks if c.strip()]
-
-def clean_chunk(chunk, model, prompt):
-    """Send a chunk to Ollama for cleaning using the given prompt."""
+    return [chunk.text for chunk in iter_chunks(split_lines(text), chunk_size=chunk_size, by_page=by_page)]
+
+def clean_chunk(chunk, model, prompt, options=None, cache=None, max_drift=None):
+    """
+    Send a chunk to Ollama for cleaning using the given prompt. With a CleanCache, repeat chunks are answered from it.
+    With max_drift, an answer that changes more than that share of the words is rejected and the chunk returned as is.
+    """
+    cleaned = None
+    if cache is not None:
+        key = cache.make_key(chunk, prompt, model, options)
+        cleaned = cache.get(key)
+        if cleaned is not None:
+            tracer.count('clean.cache_hit')
+    if cleaned is None:
+        cleaned = _ask_clean(chunk, model, prompt, options)
+        if cache is not None:
+            cache.put(key, cleaned)
+    # The check runs on cached answers too, so changing MAX_CLEAN_DRIFT never needs a model call
+    if max_drift is not None:
+        changed = drift(chunk, cleaned)
+        if changed > max_drift:
+            tracer.count('clean.rejected')
+            print(f"Rejected a cleaned chunk that changed {changed:.0%} of its words; keeping the original: {chunk[:60]!r}...")
+            return chunk
+    return cleaned
+
+def _ask_clean(chunk, model, prompt, options):
     full_prompt = f"{prompt}\n\nText:\n{chunk}\n\nCleaned Text:"
-    response = ollama.chat(model=model, messages=[{"role": "user", "content": full_prompt}])
+    with tracer.span('clean.chunk', model=model, chars=len(chunk)) as span:
+        response = ollama.chat(model=model, messages=[{"role": "user", "content": full_prompt}], options=options)
+        span.update(server_timing(response))
     return response['message']['content']
 
+def review_chunks(chunks):
+    """Interactive pre-pass: show each chunk and let the user skip or edit it. Returns the chunks to clean."""
+    reviewed = []
+    for i, chunk in enumerate(chunks):
+        print(f"\n---\nChunk {i+1}/{len(chunks)}:\n{'-'*40}\n{chunk}\n{'-'*40}")
+        action = input("[Enter] to continue, [s] to skip, [e] to edit: ").strip().lower()
+        if action == 's':
+            print("Skipping this chunk.")
+            continue
+        elif action == 'e':
+            print("Enter new chunk text (end with a blank line):")
+            new_lines = []
+            while True:
+                line = input()
+                if line == '':
+                    break
+                new_lines.append(line)
+            chunk = '\n'.join(new_lines)
+        reviewed.append(chunk)
+    return reviewed
+
+def journal_key(chunk, model, prompt, options=None, max_drift=None):
+    """Journal key of a chunk: it covers every setting that changes the cleaned text, so entries from other settings never match."""
+    return CleanCache.make_key(chunk, prompt, model, {'options': options or {}, 'max_drift': max_drift})
+
+def load_journal(journal_path):
+    """Read the checkpoint journal into {journal key: cleaned text}."""
+    done = {}
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Half-written last line from a crash
+            done[entry['hash']] = entry['cleaned']
+    return done
+
+def clean_chunks(chunks, model, prompt, workers=PIPELINE_WORKERS, journal_path=None, options=None, cache=None, failed=None,
+                 ocr_threshold=None, max_drift=None, vocabulary=None):
+    """
+    Clean chunks with up to `workers` requests in flight, yielding cleaned text in the original order.
+    chunks can be any iterable (e.g. iter_chunks over an open file): each chunk is submitted as soon as it is read.
+    Finished chunks are appended to the journal as they complete, so a rerun with the same settings only cleans what is missing.
+    Chunks that fail are left out; pass a list as `failed` to get their indices.
+    With ocr_threshold, chunks the OCR damage detector scores below it are passed through without a model call.
+    The detector needs the whole document's vocabulary (see OcrDamage.document_vocabulary); with one, chunks are
+    scored in a process pool as they are read, without one they are read in full and scored up front.
+    """
+    done = load_journal(journal_path) if journal_path else {}
+    if ocr_threshold is None:
+        scored = ((chunk, None) for chunk in chunks)
+    elif vocabulary is not None:
+        scored = iter_damage(chunks, vocabulary)
+    else:
+        chunks = list(chunks)
+        with tracer.span('clean.ocr_filter', chunks=len(chunks)) as span:
+            damages = score_chunks(chunks)
+            span['flagged'] = sum(1 for damage in damages if damage.score >= ocr_threshold)
+        scored = zip(chunks, damages)
+    results = {}
+    skipped = set()
+    futures = {}  # future -> (chunk index, journal key)
+    finished = queue.Queue()  # Futures are put here as they complete, so results are collected between reads
+    resumed = passed = cleaned = total = 0
+    next_index = 0
+    journal = open(journal_path, 'a', encoding='utf-8') if journal_path else None
+
+    def collect(future):
+        nonlocal cleaned
+        i, key = futures.pop(future)
+        try:
+            results[i] = future.result()
+            cleaned += 1
+            print(f"Cleaned chunk {i+1} ({cleaned} this run, {len(futures)} still queued)")
+            if journal:
+                journal.write(json.dumps({'hash': key, 'cleaned': results[i]}, ensure_ascii=False) + '\n')
+                journal.flush()
+        except Exception as e:
+            print(f"Failed to clean chunk {i+1}: {e} (rerun to retry it)")
+            skipped.add(i)
+            if failed is not None:
+                failed.append(i)
+
+    def ready():
+        # Hand back every chunk that is now next in line, keeping page order
+        nonlocal next_index
+        while next_index in results or next_index in skipped:
+            if next_index in results:
+                yield results.pop(next_index)
+            next_index += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i, (chunk, damage) in enumerate(scored):
+                total = i + 1
+                key = journal_key(chunk, model, prompt, options, max_drift)
+                # The pre-filter decides first, so a changed threshold is never overridden by the journal
+                if damage is not None and damage.score < ocr_threshold:
+                    results[i] = chunk
+                    passed += 1
+                elif key in done:
+                    results[i] = done[key]
+                    resumed += 1
+                else:
+                    future = pool.submit(clean_chunk, chunk, model, prompt, options, cache, max_drift)
+                    futures[future] = (i, key)
+                    future.add_done_callback(finished.put)
+                while not finished.empty():
+                    collect(finished.get())
+                yield from ready()
+            while futures:
+                collect(finished.get())
+                yield from ready()
+    finally:
+        if journal:
+            journal.close()
+    if resumed:
+        print(f"Resumed {resumed}/{total} chunks already cleaned in {journal_path}.")
+    if ocr_threshold is not None:
+        print(f"OCR pre-filter: {passed}/{total} chunks already looked clean and skipped the model.")
+
+def iter_cleaned_file(txt_path, model=OLLAMA_MODEL, prompt=CLEAN_PROMPT, chunk_size=CHUNK_SIZE, by_page=CHUNK_BY_PAGE,
+                      workers=PIPELINE_WORKERS, journal_path=None, options=None, cache=None, review=False, failed=None,
+                      ocr_threshold=None, max_drift=None):
+    """
+    Chunk a text file and yield its cleaned chunks in order (see clean_chunks). Used by main() and Pipeline.py.
+    Chunks go to the model while the file is still being read, unless review is on (the pre-pass needs them all).
+    """
+    vocabulary = None
+    if ocr_threshold is not None and not review:
+        # The OCR detector compares each chunk with the words of the whole document, so those are collected first
+        with open(txt_path, 'r', encoding='utf-8') as f:
+            vocabulary = document_vocabulary((chunk.text for chunk in iter_chunks(f, chunk_size=chunk_size, by_page=by_page)), load_dictionary())
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        chunks = (chunk.text for chunk in iter_chunks(f, chunk_size=chunk_size, by_page=by_page))
+        if review:
+            chunks = list(chunks)
+            print(f"Chunking complete: {len(chunks)} chunks.")
+            chunks = review_chunks(chunks)
+        yield from clean_chunks(chunks, model, prompt, workers=workers, journal_path=journal_path, options=options, cache=cache, failed=failed,
+                                ocr_threshold=ocr_threshold, max_drift=max_drift, vocabulary=vocabulary)
+
 def main():
+    tracer.configure(TELEMETRY_FILE)
     if not os.path.exists(TXT_FILE):
         print(f"File not found: {TXT_FILE}")
         return
-    with open(TXT_FILE, 'r', encoding='utf-8') as f:
-        text = f.read()
-    chunks = chunk_text(text, chunk_size=CHUNK_SIZE, by_page=CHUNK_BY_PAGE)
-    print(f"Chunking complete: {len(chunks)} chunks.")
-    cleaned_chunks = []
-    for i, chunk in enumerate(chunks):
-        if DEBUG_REVIEW_CHUNKS:
-            print(f"\n---\nChunk {i+1}/{len(chunks)}:\n{'-'*40}\n{chunk}\n{'-'*40}")
-            action = input("[Enter] to continue, [s] to skip, [e] to edit: ").strip().lower()
-            if action == 's':
-                print("Skipping this chunk.")
-                continue
-            elif action == 'e':
-                print("Enter new chunk text (end with a blank line):")
-                new_lines = []
-                while True:
-                    line = input()
-                    if line == '':
-                        break
-                    new_lines.append(line)
-                chunk = '\n'.join(new_lines)
-        print(f"Cleaning chunk {i+1}/{len(chunks)}...")
-        cleaned = clean_chunk(chunk, OLLAMA_MODEL, CLEAN_PROMPT)
-        cleaned_chunks.append(cleaned)
-    cleaned_text = '\n\n'.join(cleaned_chunks)
+    journal_path = JOURNAL_FILE or f"{OUTPUT_FILE or TXT_FILE}.journal.jsonl"
+    cache = CleanCache(CACHE_FILE, max_bytes=CACHE_MAX_MB * 1024 * 1024) if CACHE_FILE else None
+    failed = []
+    cleaned = iter_cleaned_file(TXT_FILE, OLLAMA_MODEL, CLEAN_PROMPT, CHUNK_SIZE, CHUNK_BY_PAGE, workers=PIPELINE_WORKERS,
+                                journal_path=journal_path, options=OLLAMA_OPTIONS, cache=cache, review=DEBUG_REVIEW_CHUNKS,
+                                failed=failed, ocr_threshold=OCR_DAMAGE_THRESHOLD, max_drift=MAX_CLEAN_DRIFT)
+    complete = True
     if OUTPUT_FILE:
         try:
+            # Chunks are written as soon as they are next in page order, not all at the end
             with open(OUTPUT_FILE, 'w', encoding='utf-8') as out:
-                out.write(cleaned_text)
+                for i, chunk in enumerate(cleaned):
+                    out.write(('\n\n' if i else '') + chunk)
+                    out.flush()
             print(f"Cleaned text written to {OUTPUT_FILE}")
-        except Exception as e:
+        except OSError as e:
             print(f"Failed to write to {OUTPUT_FILE}: {e}")
+            complete = False
     else:
+        cleaned_text = '\n\n'.join(cleaned)
         print("\n---\nCleaned Text:\n")
         print(cleaned_text)
+    # The journal is only for resuming an interrupted run; once every chunk is done it is stale
+    if complete and not failed and os.path.exists(journal_path):
+        os.remove(journal_path)
+    if cache is not None:
+        print(f"Clean cache: {cache.hits} hits, {cache.misses} misses ({cache.hits} Ollama calls saved).")
+        cache.close()
 
 # --- Debugging Model Hallucination ---
 # If the model outputs random/unrelated results, possible causes include:
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+
+# Chat templates wrap every message in role/turn markers (e.g. "<|im_start|>user\n ... <|im_end|>\n" for qwen)
+MESSAGE_OVERHEAD = 4
+# Texts longer than this that contain blank lines (assembled contexts, whole prompts) are counted block by block and
+# never cached whole: the text itself rarely comes back, but the paragraphs it is made of do
+BLOCK_COUNT_CHARS = 2000
+
+
+def estimate_tokens(text: str) -> int:
+    # Simple token estimate: 1 token ≈ 4 chars (for English, rough)
+    return len(text) // 4
+
+
+class TokenCounter:
+    """
+    Counts tokens with the model's own tokenizer when a local tokenizer.json is available
+    (needs the `tokenizers` package), otherwise falls back to the 4-chars-per-token estimate.
+    Counts are cached per text (keyed by a digest, so the cache never holds the texts themselves), and long texts
+    are summed from their blank-line separated blocks, so context paragraphs and memory messages are only
+    tokenized once however they are combined. The tokenizer itself is loaded on the first count.
+    """
+
+    def __init__(self, tokenizer_file: str = None, cache_size: int = 8192, block_chars: int = BLOCK_COUNT_CHARS):
+        self.cache_size = cache_size
+        self.block_chars = block_chars
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.encode = None
+        self.source = 'estimate (4 chars/token)'
+        self.tokenizer_file = tokenizer_file
+        self.loaded = not tokenizer_file
+
+    def _load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            tokenizer_file = self.tokenizer_file
+            if os.path.exists(tokenizer_file):
+                try:
+                    from tokenizers import Tokenizer
+                    tokenizer = Tokenizer.from_file(tokenizer_file)
+                    self.encode = lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+                    self.source = tokenizer_file
+                except ImportError:
+                    print("The 'tokenizers' package is not installed, falling back to estimated token counts.")
+                except Exception as e:
+                    print(f"Failed to load tokenizer {tokenizer_file}: {e}. Falling back to estimated token counts.")
+            else:
+                print(f"Tokenizer file not found: {tokenizer_file}. Falling back to estimated token counts.")
+            self.loaded = True
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if len(text) > self.block_chars:
+            blocks = text.split('\n\n')
+            if len(blocks) > 1:
+                # One token for each blank line between blocks
+                return sum(self.count(block) for block in blocks) + len(blocks) - 1
+        if not self.loaded:
+            self._load()
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        with self.lock:
+            tokens = self.cache.get(key)
+            if tokens is not None:
+                self.cache.move_to_end(key)
+                return tokens
+        tokens = self.encode(text) if self.encode else estimate_tokens(text)
+        with self.lock:
+            self.cache[key] = tokens
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        """Tokens for a chat message list, counting each message (and its template markers) separately."""
+        return sum(self.count(m['content']) + MESSAGE_OVERHEAD for m in messages)
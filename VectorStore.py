@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'  # sentence-transformers model used for paragraph embeddings
+VECTOR_CANDIDATES = 100  # How many nearest paragraphs a search returns
+
+
+def embedding_text(p: Dict) -> str:
+    """Text that gets embedded for one {header, page, paragraph} record."""
+    header = p.get('header') or ''
+    para = p.get('paragraph', '')
+    return f"{header}\n{para}" if header else para
+
+
+def content_hash(p: Dict) -> str:
+    return hashlib.sha256(embedding_text(p).encode('utf-8')).hexdigest()
+
+
+class VectorStore:
+    """
+    Paragraph embeddings kept on disk between runs.
+    Rows live in a raw float32 matrix (embeddings.f32) that is memory-mapped on load;
+    embeddings.json records the model, dimension and the content hash of each row,
+    so only new or edited paragraphs ever get encoded.
+    """
+
+    def __init__(self, directory: str, model_name: str = EMBEDDING_MODEL):
+        self.directory = directory
+        self.model_name = model_name
+        self.matrix_path = os.path.join(directory, 'embeddings.f32')
+        self.meta_path = os.path.join(directory, 'embeddings.json')
+        self.dim = None
+        self.hashes: List[str] = []
+        self.matrix = None
+        self.doc_rows = None  # Row of each paragraph passed to sync(), in paragraph order
+        self._encoder = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except Exception:
+            return
+        # Vectors from a different model are useless, start over
+        if meta.get('model') != self.model_name:
+            return
+        self.dim = meta['dim']
+        self.hashes = meta['hashes']
+        self._map()
+
+    def _map(self):
+        # The matrix file may be longer than the metadata if a previous run died mid-write; only map known rows
+        if self.hashes:
+            self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r', shape=(len(self.hashes), self.dim))
+        else:
+            self.matrix = None
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model_name, 'dim': self.dim, 'hashes': self.hashes}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if self._encoder is None:
+            # Loading the model takes seconds, so only do it when something actually needs encoding
+            from sentence_transformers import SentenceTransformer
+            self._encoder = SentenceTransformer(self.model_name)
+        vectors = self._encoder.encode(texts, batch_size=64, normalize_embeddings=True, show_progress_bar=len(texts) > 256)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _write_rows(self, vectors: np.ndarray, start_row: int):
+        mode = 'r+b' if os.path.exists(self.matrix_path) else 'wb'
+        # Release the map before writing to the file underneath it (required on Windows)
+        self.matrix = None
+        with open(self.matrix_path, mode) as f:
+            f.seek(start_row * self.dim * 4)
+            f.write(vectors.tobytes())
+            f.truncate()
+
+    def sync(self, paragraphs: Sequence[Dict]) -> int:
+        """Make sure every paragraph has a stored embedding; returns how many had to be encoded."""
+        doc_hashes = [content_hash(p) for p in paragraphs]
+        rows = {h: i for i, h in enumerate(self.hashes)}
+        missing = {}
+        for h, p in zip(doc_hashes, paragraphs):
+            if h not in rows and h not in missing:
+                missing[h] = embedding_text(p)
+        if missing:
+            vectors = self._encode(list(missing.values()))
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            self._write_rows(vectors, len(self.hashes))
+            for h in missing:
+                rows[h] = len(self.hashes)
+                self.hashes.append(h)
+        live = set(doc_hashes)
+        if len(self.hashes) > 2 * len(live):
+            # More dead rows than live ones (lots of edits), rewrite the matrix with live rows only
+            self._compact(live)
+            rows = {h: i for i, h in enumerate(self.hashes)}
+        elif missing:
+            self._save_meta()
+        self._map()
+        self.doc_rows = np.array([rows[h] for h in doc_hashes], dtype=np.int64)
+        return len(missing)
+
+    def _compact(self, live: set):
+        self._map()
+        keep = [i for i, h in enumerate(self.hashes) if h in live]
+        vectors = np.array(self.matrix[keep]) if keep else np.zeros((0, self.dim or 0), dtype=np.float32)
+        self.hashes = [self.hashes[i] for i in keep]
+        self._write_rows(vectors, 0)
+        self._save_meta()
+
+    def embed(self, text: str) -> np.ndarray:
+        """Normalized embedding of a single text (e.g. a question)."""
+        return self._encode([text])[0]
+
+    def search(self, question: str, limit: int = VECTOR_CANDIDATES) -> List[Tuple[int, float]]:
+        """Return (paragraph index, cosine similarity) pairs for the closest paragraphs, best first."""
+        if self.matrix is None or self.doc_rows is None or not len(self.doc_rows):
+            return []
+        query = self.embed(question)
+        # Vectors are normalized, so a dot product is cosine similarity
+        scores = (self.matrix @ query)[self.doc_rows]
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top]
@@ -4,10 +4,21 @@ import os
 import tkinter as tk
 from tkinter import messagebox
 import threading
+import queue
+from collections import deque
+
+from Telemetry import tracer
 
 # MarkdownText fallback: always use tk.Text (MarkdownText not available)
 MarkdownText = tk.Text
 
+# How often (ms) streamed text is moved from the worker thread into the chat window.
+# Chunks that arrive in between are inserted together, so Tk isn't flooded with per-token callbacks.
+STREAM_FLUSH_MS = 50
+# Turns (question + answer) shown in the chat window. Older ones are removed from the top as new ones arrive,
+# so a long conversation costs the same per turn as a short one; the full history stays in the memory file.
+CHAT_VIEW_TURNS = 100
+
 
 def start_gui(
 	JSONL_FILE,
@@ -21,18 +32,24 @@ def start_gui(
 	save_memory,
 	ask_ollama,
 	count_tokens,
-	rag_context
+	rag_context,
+	STREAM_RESPONSES=False,
+	startup=None
 ):
+	# startup(progress) runs on a worker thread after the window opens (corpus loading, model lookup).
+	# It returns a dict that may replace ask_ollama, rag_context, MAX_INPUT_TOKENS and TOKEN_WARN_THRESHOLD.
 	memory = load_memory()
+	# Token totals are kept up to date by the worker threads, so the Tk thread never counts anything
+	token_counts = {'context': 0, 'history': 0}
+	turn_marks = deque()  # Mark at the end of every turn shown in the chat window, oldest first
+	turn_serial = 0
+
+	def count_history_tokens():
+		# prompt_history() is bounded by the memory settings, so this costs the same however long the chat gets
+		return sum(count_tokens(m['content']) for m in memory.prompt_history())
 
 	def get_current_context_tokens():
-		# Combine context and memory
-		messages = []
-		for m in memory:
-			messages.append(m)
-		messages.append({"role": "system", "content": f"Reference context for this session:\n{rag_context}"})
-		total_input = '\n'.join([m['content'] for m in messages])
-		return count_tokens(total_input)
+		return token_counts['context'] + token_counts['history']
 
 	root = tk.Tk()
 	root.title("NHP RAG Chat (Ollama)")
@@ -44,24 +61,45 @@ def start_gui(
 	entry = tk.Entry(root, width=80)
 	entry.grid(row=1, column=0, padx=5, pady=5, sticky='ew')
 
-	context_tokens = get_current_context_tokens()
-	if context_tokens >= TOKEN_WARN_THRESHOLD:
-		token_label = tk.Label(root, text=f"Warning! Token count approaching max: {context_tokens} / {MAX_INPUT_TOKENS}")
+	if startup is not None:
+		# Token counts wait for startup too (the tokenizer is loaded on first use)
+		token_label = tk.Label(root, text="Starting up...")
 	else:
-		token_label = tk.Label(root, text=f"Current token count: {context_tokens} / {MAX_INPUT_TOKENS}")
+		token_counts.update(context=count_tokens(rag_context), history=count_history_tokens())
+		context_tokens = get_current_context_tokens()
+		if context_tokens >= TOKEN_WARN_THRESHOLD:
+			token_label = tk.Label(root, text=f"Warning! Token count approaching max: {context_tokens} / {MAX_INPUT_TOKENS}")
+		else:
+			token_label = tk.Label(root, text=f"Current token count: {context_tokens} / {MAX_INPUT_TOKENS}")
 	token_label.grid(row=2, column=0, sticky='w', padx=5)
 
+	def end_turn():
+		# Called with the chat display in 'normal' state, after a turn's last line was inserted
+		nonlocal turn_serial
+		turn_serial += 1
+		name = f"turn{turn_serial}"
+		chat_display.mark_set(name, 'end-1c')
+		chat_display.mark_gravity(name, 'left')
+		turn_marks.append(name)
+		while len(turn_marks) > CHAT_VIEW_TURNS:
+			oldest = turn_marks.popleft()
+			chat_display.delete('1.0', oldest)
+			chat_display.mark_unset(oldest)
+
 	def render_conversation():
-		chat_display.config(state='normal')
-		chat_display.delete('1.0', tk.END)
-		# Render all messages in memory as markdown
-		for m in memory:
-			if m['role'] == 'user':
-				chat_display.insert(tk.END, f"**You:** {m['content']}\n\n")
-			elif m['role'] == 'assistant':
-				chat_display.insert(tk.END, f"**NHP:** {m['content']}\n\n")
-		chat_display.config(state='disabled')
-		chat_display.see(tk.END)
+		# Only at startup: the last CHAT_VIEW_TURNS turns in memory; after that turns are appended one by one
+		with tracer.span('gui.render', messages=len(memory)):
+			chat_display.config(state='normal')
+			chat_display.delete('1.0', tk.END)
+			messages = memory[max(len(memory) - 2 * CHAT_VIEW_TURNS, 0):]
+			for m in messages:
+				if m['role'] == 'user':
+					chat_display.insert(tk.END, f"**You:** {m['content']}\n\n")
+				elif m['role'] == 'assistant':
+					chat_display.insert(tk.END, f"**NHP:** {m['content']}\n\n")
+					end_turn()
+			chat_display.config(state='disabled')
+			chat_display.see(tk.END)
 
 	def send():
 		user_input = entry.get().strip()
@@ -71,9 +109,16 @@ def start_gui(
 		send_btn.config(state='disabled')
 		chat_display.config(state='normal')
 		chat_display.insert(tk.END, f"**You:** {user_input}\n\n")
-		chat_display.insert(tk.END, "**NHP:** [Thinking...]\n\n")
+		chat_display.insert(tk.END, "**NHP:** ")
+		chat_display.insert(tk.END, "[Thinking...]", 'thinking')
+		chat_display.insert(tk.END, "\n\n")
+		# The answer is inserted at this mark, which sits just before the trailing blank line
+		chat_display.mark_set('stream', 'end-3c')
 		chat_display.config(state='disabled')
 		chat_display.see(tk.END)
+		if STREAM_RESPONSES:
+			stream_reply(user_input)
+			return
 		def worker():
 			try:
 				answer, token_msg = ask_ollama(rag_context, user_input, memory, model=OLLAMA_MODEL)
@@ -83,24 +128,113 @@ def start_gui(
 			memory.append({"role": "user", "content": user_input})
 			memory.append({"role": "assistant", "content": answer})
 			save_memory(memory)
-			def update_display():
-				render_conversation()
+			history_tokens = count_history_tokens()
+			root.after(0, lambda: update_display(token_msg, history_tokens, answer))
+		threading.Thread(target=worker, daemon=True).start()
+
+	def insert_answer(text):
+		# Replaces the "[Thinking...]" placeholder on the first insert
+		if chat_display.tag_ranges('thinking'):
+			chat_display.delete('thinking.first', 'thinking.last')
+		chat_display.insert('stream', text)
+
+	def update_display(token_msg, history_tokens, answer=None):
+		with tracer.span('gui.render', messages=len(memory)):
+			chat_display.config(state='normal')
+			if answer is not None:
+				insert_answer(answer)
+			chat_display.insert(tk.END, f"*{token_msg}*\n\n")
+			end_turn()
+			chat_display.config(state='disabled')
+			chat_display.see(tk.END)
+		entry.config(state='normal')
+		send_btn.config(state='normal')
+		# Update context token label
+		token_counts['history'] = history_tokens
+		refresh_token_label(" | Last answer: cached" if token_msg.startswith("[Cached response") else "")
+
+	def refresh_token_label(suffix=""):
+		context_tokens = get_current_context_tokens()
+		token_label.config(text=f"Model max tokens: {MAX_INPUT_TOKENS} | Warning at: {TOKEN_WARN_THRESHOLD} | Current context: {context_tokens}" + suffix)
+
+	def stream_reply(user_input):
+		# The worker thread only queues chunks; pump() runs on the Tk thread and drains them in batches
+		pending = queue.Queue()
+		done = object()
+		result = {'token_msg': "", 'history_tokens': 0}
+		def worker():
+			parts = []
+			try:
+				chunks, result['token_msg'] = ask_ollama(rag_context, user_input, memory, model=OLLAMA_MODEL, stream=True)
+				for chunk in chunks:
+					if chunk:
+						parts.append(chunk)
+						pending.put(chunk)
+			except Exception as e:
+				parts.append(f"[Error: {e}]")
+				pending.put(f"[Error: {e}]")
+			memory.append({"role": "user", "content": user_input})
+			memory.append({"role": "assistant", "content": ''.join(parts)})
+			save_memory(memory)
+			result['history_tokens'] = count_history_tokens()
+			pending.put(done)
+		def pump():
+			texts = []
+			finished = False
+			while True:
+				try:
+					item = pending.get_nowait()
+				except queue.Empty:
+					break
+				if item is done:
+					finished = True
+					break
+				texts.append(item)
+			if texts:
 				chat_display.config(state='normal')
-				chat_display.insert(tk.END, f"*{token_msg}*\n\n")
+				insert_answer(''.join(texts))
 				chat_display.config(state='disabled')
 				chat_display.see(tk.END)
-				entry.config(state='normal')
-				send_btn.config(state='normal')
-				# Update context token label
-				context_tokens = get_current_context_tokens()
-				token_label.config(text=f"Model max tokens: {MAX_INPUT_TOKENS} | Warning at: {TOKEN_WARN_THRESHOLD} | Current context: {context_tokens}")
-			root.after(0, update_display)
+			if finished:
+				update_display(result['token_msg'], result['history_tokens'])
+			else:
+				root.after(STREAM_FLUSH_MS, pump)
 		threading.Thread(target=worker, daemon=True).start()
+		root.after(STREAM_FLUSH_MS, pump)
 
 	entry.bind('<Return>', lambda event: send())
 	send_btn = tk.Button(root, text="Send", command=send)
 	send_btn.grid(row=1, column=1, padx=5, pady=5)
 
+	def run_startup():
+		entry.config(state='disabled')
+		send_btn.config(state='disabled')
+		def progress(text):
+			root.after(0, lambda: token_label.config(text=text))
+		def worker():
+			try:
+				loaded = startup(progress)
+				counts = {'context': count_tokens(loaded.get('rag_context', rag_context)), 'history': count_history_tokens()}
+			except Exception as e:
+				message = f"Startup failed: {e}"
+				root.after(0, lambda: token_label.config(text=message))
+				return
+			root.after(0, lambda: finish_startup(loaded, counts))
+		threading.Thread(target=worker, daemon=True).start()
+
+	def finish_startup(loaded, counts):
+		nonlocal ask_ollama, rag_context, MAX_INPUT_TOKENS, TOKEN_WARN_THRESHOLD
+		ask_ollama = loaded.get('ask_ollama', ask_ollama)
+		rag_context = loaded.get('rag_context', rag_context)
+		MAX_INPUT_TOKENS = loaded.get('MAX_INPUT_TOKENS', MAX_INPUT_TOKENS)
+		TOKEN_WARN_THRESHOLD = loaded.get('TOKEN_WARN_THRESHOLD', TOKEN_WARN_THRESHOLD)
+		token_counts.update(counts)
+		entry.config(state='normal')
+		send_btn.config(state='normal')
+		refresh_token_label()
+
 	render_conversation()
+	if startup is not None:
+		run_startup()
 
 	root.mainloop()
@@ -0,0 +1,42 @@
+import importlib
+
+import pytest
+
+pymupdf = pytest.importorskip('pymupdf')
+pytest.importorskip('pymupdf4llm')
+extractor = importlib.import_module('PDF Extractor')
+
+SAMPLE_PAGES = 20
+
+
+def make_sample_pdf(path, pages=SAMPLE_PAGES):
+    """A small rulebook-like PDF: a header, a few paragraphs and a printed page number on every page."""
+    doc = pymupdf.open()
+    for n in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"SECTION {n // 5 + 1}", fontsize=16)
+        for k in range(4):
+            text = (f"Paragraph {k + 1} of page {n}. Lock On grants +1 Accuracy to the next attack against the target. "
+                    f"Heat {n % 7} and Range {k + 3} apply while the pilot's mech is Exposed.")
+            page.insert_textbox(pymupdf.Rect(72, 110 + 100 * k, 520, 200 + 100 * k), text, fontsize=11)
+        page.insert_text((300, 800), str(n), fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def test_parallel_output_matches_serial(tmp_path):
+    pdf_path = str(tmp_path / 'sample.pdf')
+    make_sample_pdf(pdf_path)
+    serial_path = tmp_path / 'serial.txt'
+    parallel_path = tmp_path / 'parallel.txt'
+    extractor.extract_serial(pdf_path, str(serial_path))
+    # Shards that don't divide the page count evenly, so the last one is short
+    extractor.extract_parallel(pdf_path, str(parallel_path), pages_per_shard=7, workers=2)
+    serial = serial_path.read_bytes()
+    assert serial
+    assert parallel_path.read_bytes() == serial
+
+
+def test_glyphs_are_translated():
+    glyph, word = next(iter(extractor.GlyphTable.items()))
+    assert f"2{chr(glyph)} damage".translate(extractor.GlyphTable) == f"2{word} damage"
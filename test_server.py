@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import NHP
+import Server
+from FakeOllama import FakeClient
+
+BOOK = """LOCK ON
+[379]
+Lock On grants +1 Accuracy to the next attack against the target.
+
+OVERCHARGE
+[380]
+Overcharge lets a mech take an extra quick action at the cost of heat.
+"""
+
+
+@pytest.fixture(autouse=True)
+def nhp_config(tmp_path, monkeypatch):
+    # A tiny book and scratch files, so nothing outside tmp_path is read or written
+    book = tmp_path / 'book.txt'
+    book.write_text(BOOK, encoding='utf-8')
+    monkeypatch.setattr(NHP, 'CONTEXT_FILES', [str(book)])
+    monkeypatch.setattr(NHP, 'RETRIEVAL_INDEX_FILE', None)
+    monkeypatch.setattr(NHP, 'STAT_FILES', [])
+    monkeypatch.setattr(NHP, 'RESPONSE_CACHE', False)
+    monkeypatch.setattr(NHP, 'MODEL_INFO_FILE', str(tmp_path / 'model_info.json'))
+    monkeypatch.setattr(NHP, 'MAX_INPUT_TOKENS', NHP.MAX_INPUT_TOKENS)
+    monkeypatch.setattr(NHP, 'TOKEN_WARN_THRESHOLD', NHP.TOKEN_WARN_THRESHOLD)
+    monkeypatch.setattr(Server, 'SESSION_DIR', str(tmp_path / 'sessions'))
+
+
+def run_server(client, scenario):
+    """Start NHPServer(client) on an ephemeral port and return what scenario(port, nhp_server) returns."""
+    async def main():
+        nhp_server = Server.NHPServer(client)
+        server = await asyncio.start_server(nhp_server.handle, '127.0.0.1', 0)
+        try:
+            return await scenario(server.sockets[0].getsockname()[1], nhp_server)
+        finally:
+            server.close()
+            await server.wait_closed()
+    return asyncio.run(main())
+
+
+async def request(port, method, path, body=None):
+    """(status, body text) of one HTTP request."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), payload.decode('utf-8')
+
+
+async def ask(port, session, question):
+    status, payload = await request(port, 'POST', '/ask', {"session": session, "question": question})
+    return status, json.loads(payload)
+
+
+async def ask_memory(port, session):
+    status, payload = await request(port, 'GET', f'/memory?session={session}')
+    return status, json.loads(payload)
+
+
+def test_ask_answers_and_remembers():
+    client = FakeClient()
+
+    async def scenario(port, nhp_server):
+        status, answer = await ask(port, 'pilot', "What does Lock On do?")
+        status_memory, memory = await ask_memory(port, 'pilot')
+        return status, answer, status_memory, memory
+
+    status, answer, status_memory, memory = run_server(client, scenario)
+    assert status == 200
+    assert answer['answer'] == client.reply
+    assert answer['token_msg'].startswith("[Token usage:")
+    # The retrieved paragraph was sent to the model
+    assert any("Lock On grants +1 Accuracy" in m['content'] for m in client.calls[0]['messages'])
+    assert status_memory == 200
+    assert memory['messages'] == [
+        {"role": "user", "content": "What does Lock On do?"},
+        {"role": "assistant", "content": client.reply},
+    ]
+
+
+def test_stream_sends_chunks_then_done():
+    client = FakeClient(chunk_size=10)
+
+    async def scenario(port, nhp_server):
+        status, payload = await request(port, 'POST', '/stream', {"session": 'pilot', "question": "What does Lock On do?"})
+        return status, [json.loads(line) for line in payload.splitlines()], list(nhp_server.sessions['pilot'])
+
+    status, lines, memory = run_server(client, scenario)
+    assert status == 200
+    assert lines[-1]['done'] is True and lines[-1]['token_msg'].startswith("[Token usage:")
+    assert ''.join(line['chunk'] for line in lines[:-1]) == client.reply
+    assert len(lines) - 1 == len(client.chunks())
+    assert memory[-1] == {"role": "assistant", "content": client.reply}
+
+
+def test_stream_disconnect_stops_the_model_before_freeing_its_slot(monkeypatch):
+    monkeypatch.setattr(Server, 'MAX_MODEL_REQUESTS', 1)
+    client = FakeClient(chunk_size=2, chunk_delay=0.02)
+
+    async def scenario(port, nhp_server):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        data = json.dumps({"session": 'pilot', "question": "What does Lock On do?"}).encode('utf-8')
+        writer.write(f"POST /stream HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+        await reader.readuntil(b'"chunk"')
+        writer.transport.abort()
+        for _ in range(200):
+            if len(nhp_server.sessions['pilot']) == 2:
+                break
+            # The slot stays taken for as long as the model is still generating
+            assert nhp_server.model_slots.locked()
+            await asyncio.sleep(0.01)
+        return list(nhp_server.sessions['pilot']), nhp_server.model_slots.locked()
+
+    memory, locked = run_server(client, scenario)
+    assert not locked
+    assert client.responses == []  # The fake model never got to the end of its reply
+    # The part that was generated before the client left is remembered
+    assert memory[0]['role'] == 'user'
+    assert client.reply.startswith(memory[1]['content']) and memory[1]['content'] != client.reply
+
+
+def test_memory_get_and_delete():
+    client = FakeClient()
+
+    async def scenario(port, nhp_server):
+        await ask(port, 'pilot', "What does Lock On do?")
+        path = nhp_server.sessions['pilot'].path
+        existed = os.path.exists(path)
+        status, payload = await request(port, 'DELETE', '/memory?session=pilot')
+        return existed, os.path.exists(path), status, json.loads(payload), await ask_memory(port, 'pilot')
+
+    existed, exists, status, deleted, (status_memory, memory) = run_server(client, scenario)
+    assert existed and not exists
+    assert status == 200 and deleted == {"session": 'pilot', "deleted": True}
+    assert status_memory == 200
+    assert memory == {"session": 'pilot', "summary": '', "messages": []}
+
+
+def test_delete_drops_a_running_compaction(monkeypatch):
+    monkeypatch.setattr(NHP, 'MEMORY_KEEP_TURNS', 0)  # Every saved turn starts a summary right away
+    client = FakeClient(first_token_delay=0.2)
+
+    async def scenario(port, nhp_server):
+        await ask(port, 'pilot', "What does Lock On do?")
+        path = nhp_server.sessions['pilot'].path
+        compacting = nhp_server.sessions['pilot'].compacting
+        await request(port, 'DELETE', '/memory?session=pilot')
+        await asyncio.sleep(0.5)  # The summary call finishes after the delete
+        return compacting, os.path.exists(path), await ask_memory(port, 'pilot')
+
+    compacting, exists, (_, memory) = run_server(client, scenario)
+    assert compacting
+    assert len(client.calls) == 2  # The question and the summary
+    assert not exists
+    assert memory == {"session": 'pilot', "summary": '', "messages": []}
+
+
+def test_bad_session_is_rejected():
+    async def scenario(port, nhp_server):
+        return await ask(port, '../etc', "What does Lock On do?")
+
+    status, payload = run_server(FakeClient(), scenario)
+    assert status == 400 and 'session' in payload['error']
+
+
+def test_full_queue_answers_503(monkeypatch):
+    monkeypatch.setattr(Server, 'MAX_MODEL_REQUESTS', 1)
+    monkeypatch.setattr(Server, 'MAX_QUEUED_REQUESTS', 1)
+    client = FakeClient(first_token_delay=0.5)
+
+    async def scenario(port, nhp_server):
+        # Different questions from different sessions, so nothing is shared: one runs, one waits, one is turned away
+        running = asyncio.create_task(ask(port, 'a', "What does Lock On do?"))
+        await asyncio.sleep(0.1)
+        waiting = asyncio.create_task(ask(port, 'b', "What does Overcharge do?"))
+        await asyncio.sleep(0.1)
+        rejected = await ask(port, 'c', "How much heat does Overcharge cost?")
+        return rejected, await running, await waiting
+
+    rejected, running, waiting = run_server(client, scenario)
+    assert rejected[0] == 503 and 'error' in rejected[1]
+    assert running[0] == 200 and waiting[0] == 200
+    assert len(client.calls) == 2
+
+
+def test_identical_questions_share_one_model_call():
+    client = FakeClient(first_token_delay=0.3)
+    sessions = ['a', 'b', 'c', 'd']
+
+    async def scenario(port, nhp_server):
+        return await asyncio.gather(*(ask(port, session, "What does Lock On do?") for session in sessions))
+
+    results = run_server(client, scenario)
+    assert len(client.calls) == 1
+    assert all(status == 200 and answer['answer'] == client.reply for status, answer in results)
+    assert sum(answer['token_msg'].startswith("[Shared answer") for _, answer in results) == len(sessions) - 1
+
+
+def test_model_info_is_not_saved_when_asked():
+    NHP.refresh_model_info(NHP.OLLAMA_MODEL, FakeClient(context_length=1234), save=False)
+    assert NHP.MAX_INPUT_TOKENS == 1234
+    assert not os.path.exists(NHP.MODEL_INFO_FILE)
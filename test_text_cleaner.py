@@ -0,0 +1,73 @@
+import io
+
+import pytest
+
+pytest.importorskip('ollama')
+import TextCleaner
+
+# Paragraphs, a table followed straight away by text, a paragraph longer than the chunk size and a table at EOF
+SAMPLE = (
+    "LOCK ON\n"
+    "[12]\n"
+    "Lock On grants +1 Accuracy to the next attack\n"
+    "against the target.\n"
+    "\n"
+    "| Weapon | Range | Damage |\n"
+    "+--------+-------+--------+\n"
+    "| Rifle  | 10    | 1d6    |\n"
+    "Range is measured in spaces.\n"
+    "A long paragraph that keeps going past the chunk size so the chunker has to flush it\n"
+    "in the middle, before its blank line, and carry on with a new chunk for the rest\n"
+    "of the paragraph which ends here.\n"
+    "\n"
+    "[13]\n"
+    "OVERCHARGE\n"
+    "Overcharge lets a mech take an extra quick action.\n"
+    "\n"
+    "\n"
+    "+------+------+\n"
+    "| Heat | Cost |\n"
+    "+------+------+"
+)
+
+# What the splitter produced before it was rewritten as a single-pass stream
+PARAGRAPH_CHUNKS = [
+    "LOCK ON\n[12]\nLock On grants +1 Accuracy to the next attack\nagainst the target.",
+    "| Weapon | Range | Damage |\n+--------+-------+--------+\n| Rifle  | 10    | 1d6    |",
+    "Range is measured in spaces.\n"
+    "A long paragraph that keeps going past the chunk size so the chunker has to flush it\n"
+    "in the middle, before its blank line, and carry on with a new chunk for the rest",
+    "of the paragraph which ends here.",
+    "[13]\nOVERCHARGE\nOvercharge lets a mech take an extra quick action.",
+    "+------+------+\n| Heat | Cost |\n+------+------+",
+]
+PAGE_CHUNKS = [
+    "LOCK ON",
+    "Lock On grants +1 Accuracy to the next attack\nagainst the target.\n\n"
+    "| Weapon | Range | Damage |\n+--------+-------+--------+\n| Rifle  | 10    | 1d6    |\n"
+    "Range is measured in spaces.\n"
+    "A long paragraph that keeps going past the chunk size so the chunker has to flush it\n"
+    "in the middle, before its blank line, and carry on with a new chunk for the rest\n"
+    "of the paragraph which ends here.",
+    "OVERCHARGE\nOvercharge lets a mech take an extra quick action.\n\n\n+------+------+\n| Heat | Cost |\n+------+------+",
+]
+
+
+def test_paragraph_chunks():
+    assert TextCleaner.chunk_text(SAMPLE, chunk_size=120) == PARAGRAPH_CHUNKS
+
+
+def test_paragraph_chunks_without_a_size_flush():
+    merged = PARAGRAPH_CHUNKS[:2] + ['\n'.join(PARAGRAPH_CHUNKS[2:4])] + PARAGRAPH_CHUNKS[4:]
+    assert TextCleaner.chunk_text(SAMPLE, chunk_size=1500) == merged
+
+
+def test_page_chunks():
+    assert TextCleaner.chunk_text(SAMPLE, by_page=True) == PAGE_CHUNKS
+
+
+@pytest.mark.parametrize('by_page, expected', [(False, PARAGRAPH_CHUNKS), (True, PAGE_CHUNKS)])
+def test_file_lines_chunk_the_same(by_page, expected):
+    # An open file hands over its lines with their newlines
+    chunks = TextCleaner.iter_chunks(io.StringIO(SAMPLE), chunk_size=120, by_page=by_page)
+    assert [chunk.text for chunk in chunks] == expected